@@ -0,0 +1,58 @@
+"""Script: Compare forecasting one window at a time with the batched worker.
+
+Predicts a 2 day window of minutes (synthetic, normalized inputs) with a
+model of ml_models/config.json, once like /api/v1/forecast used to
+(batch size 1) and once like the forecast worker
+(forecaster.batch_model, config.FORECAST_BATCH_SIZE), and prints rows/s.
+The NumPy export of the model (numpy_lstm.py) is timed too if there is one.
+
+python bench_forecast.py
+    --target=cwshdr [optional, model of config.json to use]
+    --minutes=2880 [optional, windows to predict]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import config as cfg
+import forecaster
+import numpy_lstm
+import process
+
+from model_registry import ModelRegistry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark forecasting")
+    parser.add_argument("--target", type=str, default="cwshdr", help="Target of the model to use")
+    parser.add_argument("--minutes", type=int, default=2 * 24 * 60, help="Windows to predict")
+    args = parser.parse_args()
+
+    model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml_models")
+    config = ModelRegistry(model_dir, forecaster.load_model).config(args.target)
+    model_path = os.path.splitext(os.path.join(model_dir, config["model_name"]))[0] + ".h5"
+
+    rng = np.random.RandomState(0)
+    data = rng.uniform(0.1, 1, (args.minutes + config["lookback"], len(config["features"])))
+    X, _ = process.sliding_windows(data, data[:, 0], config["lookback"], args.minutes)
+    X = process.Reshape.x(X)
+
+    runs = [("batch size 1", forecaster.batch_model(model_path, batch_size=1), 1),
+            ("batched", forecaster.batch_model(model_path), cfg.FORECAST_BATCH_SIZE)]
+    npz_path = os.path.splitext(model_path)[0] + ".npz"
+    if os.path.exists(npz_path):
+        runs.append(("numpy", numpy_lstm.load(npz_path), cfg.FORECAST_BATCH_SIZE))
+
+    for name, model, batch_size in runs:
+        model.predict(X[:batch_size], batch_size=batch_size)
+        start = time.time()
+        model.predict(X, batch_size=batch_size)
+        elapsed = time.time() - start
+        print("{:<14} {} rows in {:.2f}s, {:.0f} rows/s".format(name, X.shape[0], elapsed, X.shape[0] / elapsed))
+
+
+if __name__ == "__main__":
+    main()
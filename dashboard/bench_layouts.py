@@ -0,0 +1,100 @@
+"""Script: Compare the "rows" and "buckets" log layouts on synthetic data.
+
+Loads a year (by default) of synthetic minute logs into two scratch
+databases, one per layout, and prints the storage size, the ingest rate
+and the latency of the aggregations behind /api/v1/logs for each.
+The scratch databases are dropped afterwards.
+
+python bench_layouts.py
+    --host=localhost [database host name]
+    --port=27017 [database port name]
+    --days=365 [optional, days of minute data]
+    --fields=10 [optional, number of sensor fields]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import pymongo
+import pytz
+
+import config as cfg
+import dashboard
+import log_buckets
+
+
+SITE = "bench"
+
+# (freq, span) of the /api/v1/logs queries timed
+QUERIES = [("minutes", "1D"), ("hours", "7D"), ("days", "90D")]
+
+
+def synthetic_logs(days, n_fields, seed=0):
+    """Minute logs with a daily cycle, noise and a few gaps."""
+    rng = np.random.RandomState(seed)
+    index = pd.date_range("2017-01-01", periods=days * 24 * 60, freq="min", tz=pytz.UTC)
+    hours = index.hour.values + index.minute.values / 60.0
+    df = pd.DataFrame({"timestamp": index})
+    for i in range(n_fields):
+        values = 10 + 5 * np.sin(2 * np.pi * hours / 24 + i) + rng.normal(0, 0.5, len(index))
+        values[rng.rand(len(index)) < 0.01] = np.nan
+        df["field_{}".format(i)] = values
+    return df
+
+
+def load_rows(db, df):
+    records = df.assign(_site=SITE).to_dict("records")
+    for i in range(0, len(records), 30 ** 3):
+        db.log.insert_many(records[i:i + 30 ** 3])
+    db.log.create_index([("_site", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)])
+
+
+def load_buckets(db, df):
+    log_buckets.ensure_indexes(db)
+    log_buckets.save_buckets(db, df, SITE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the log storage layouts")
+    parser.add_argument("--host", type=str, help="MongoDB Host")
+    parser.add_argument("--port", type=int, help="MongoDB Port")
+    parser.add_argument("--days", type=int, default=365, help="Days of minute data")
+    parser.add_argument("--fields", type=int, default=10, help="Number of sensor fields")
+    args = parser.parse_args()
+
+    df = synthetic_logs(args.days, args.fields)
+    fields = [c for c in df.columns if c != "timestamp"]
+    end = df.timestamp.iloc[-1].to_pydatetime()
+    client = pymongo.MongoClient(host=args.host, port=args.port, tz_aware=True)
+    print("{} rows x {} fields".format(df.shape[0], len(fields)))
+
+    for layout, load, collection in [("rows", load_rows, "log"),
+                                     ("buckets", load_buckets, log_buckets.COLLECTION)]:
+        name = "bench_layout_" + layout
+        client.drop_database(name)
+        db = client[name]
+        try:
+            start = time.time()
+            load(db, df)
+            elapsed = time.time() - start
+            stats = db.command("collstats", collection)
+            print("{}: ingest {:.0f} rows/s, size {:.1f} MB, storage {:.1f} MB, indexes {:.1f} MB".format(
+                layout, df.shape[0] / elapsed, stats["size"] / 2 ** 20,
+                stats["storageSize"] / 2 ** 20, stats["totalIndexSize"] / 2 ** 20))
+
+            # the aggregations behind /api/v1/logs, without the cache and rollups
+            dashboard.app.config["db"] = db
+            cfg.LOG_LAYOUT, cfg.USE_ROLLUPS = layout, False
+            for freq, span in QUERIES:
+                ranges = [{"$gt": end - pd.Timedelta(span).to_pytimedelta(), "$lte": end}]
+                start = time.time()
+                docs = list(dashboard.aggregate_logs(SITE, fields, ranges, freq, "avg"))
+                print("  {} over {}: {} buckets in {:.3f} s".format(freq, span, len(docs), time.time() - start))
+        finally:
+            client.drop_database(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""LRU cache of aggregated log buckets, used by query_logs."""
+import collections
+import datetime as dt
+import threading
+import time
+
+
+# the calendar block cached as one entry, for each query freq.
+# eg. the minute buckets of a field are cached one day at a time.
+BLOCKS = {
+    "years"   : "years",
+    "months"  : "years",
+    "days"    : "years",
+    "hours"   : "months",
+    "minutes" : "days"
+}
+
+
+def floor_time(t, unit):
+    """Start of the `unit` (years ... seconds) containing datetime t."""
+    t = t.replace(microsecond=0)
+    if unit == "seconds":
+        return t
+    t = t.replace(second=0)
+    if unit == "minutes":
+        return t
+    t = t.replace(minute=0)
+    if unit == "hours":
+        return t
+    t = t.replace(hour=0)
+    if unit == "days":
+        return t
+    t = t.replace(day=1)
+    if unit == "months":
+        return t
+    return t.replace(month=1)
+
+
+def next_time(t, unit):
+    """Start of the `unit` following the one containing datetime t."""
+    t = floor_time(t, unit)
+    if unit == "years":
+        return t.replace(year=t.year + 1)
+    if unit == "months":
+        return t.replace(year=t.year + t.month // 12, month=t.month % 12 + 1)
+    return t + dt.timedelta(**{unit: 1})
+
+
+def trunc_expr(unit, date="$timestamp"):
+    """Aggregation expression of floor_time(date, unit) for years ... minutes."""
+    parts = [("year", "$year"), ("month", "$month"), ("day", "$dayOfMonth"),
+             ("hour", "$hour"), ("minute", "$minute")]
+    units = ["years", "months", "days", "hours", "minutes"]
+    parts = parts[:units.index(unit) + 1]
+    return {"$dateFromParts": dict((name, {op: date}) for name, op in parts)}
+
+
+class BucketCache:
+    """LRU cache of aggregated buckets.
+
+    An entry holds the buckets of one field over one closed calendar block,
+    keyed by (site, field, freq, aggregate, block start), as a sorted list of
+    (bucket start, value). `size` bounds the number of buckets kept (an
+    empty entry counts as one, put() takes the cost of other entries).
+    Entries expire `ttl` seconds after they
+    were cached (never with None), so logs loaded later into a cached block
+    show up.
+    """
+
+    def __init__(self, size=1000000, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.buckets = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Cached entry of key, None on a miss."""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and item[1] is not None and item[1] <= time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, entry, cost=None):
+        """Cache entry, evicting the least recently used ones beyond size.
+
+        cost is what the entry counts against size, default its buckets.
+        """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        cost = max(len(entry), 1) if cost is None else cost
+        with self.lock:
+            if key in self.entries:
+                self._pop(key)
+            self.entries[key] = (entry, expires, cost)
+            self.buckets += cost
+            while self.buckets > self.size and len(self.entries) > 1:
+                self._pop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.buckets = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self.entries),
+                "buckets": self.buckets,
+                "size": self.size,
+                "ttl": self.ttl
+            }
+
+    def _pop(self, key):
+        self.buckets -= self.entries.pop(key)[2]
+
+
+def entry_range(entry, start, end):
+    """Items of a cache entry with start <= bucket start < end."""
+    return [i for i in entry if start <= i[0] < end]
@@ -17,3 +17,38 @@ DEBUG = True
 # assumes current time as this while processing queries
 # useful for debugging. set this to None in production..
 CURRENT_TIME = datetime.datetime(2017, 1, 1, tzinfo=pytz.UTC)
+
+# number of aggregated buckets query_logs keeps in memory
+QUERY_CACHE_SIZE = 1000000
+
+# seconds the buckets stay cached, logs loaded into a cached block (eg. a
+# late csv2mongo.py run) are served once they expire. None keeps them
+QUERY_CACHE_TTL = 15 * 60
+
+# hourly abnormality thresholds kept in memory, one set per site, field,
+# freq and training days (see dashboard.hourly_thresholds). they expire
+# like the buckets
+THRESHOLD_CACHE_SIZE = 10000
+
+# aggregate hours, days, months and years from the rollup collections
+# (see rollups.py). the raw logs of a site are aggregated until its
+# rollups are backfilled once
+USE_ROLLUPS = True
+
+# storage layout of the logs: "rows" (one document per minute, csv2mongo's
+# default) or "buckets" (one document per site, field and day, see log_buckets.py)
+LOG_LAYOUT = "rows"
+
+# forecast worker (see forecaster.py): seconds between runs (None disables it),
+# windows predicted per batch and days forecast on an empty forecast collection
+FORECAST_INTERVAL = 60
+FORECAST_BATCH_SIZE = 1024
+FORECAST_HISTORY_DAYS = 2
+
+# import pandas, sklearn and load the forecast models at startup instead of
+# on the first forecast (see dashboard.prewarm)
+PREWARM_FORECAST = False
+
+# bytes of model weights kept in memory, the least recently used models
+# beyond it are unloaded (see model_registry.py)
+MODEL_MEMORY_BUDGET = 512 * 2 ** 20
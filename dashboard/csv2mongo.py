@@ -2,12 +2,33 @@
 
 How to use the script:
 
-python load_to_mongo.py
+python csv2mongo.py
     --db=dashboard [database name]
     --host=localhost [database host name]
     --port=27017 [database port name]
     --site=np --[dataset chiller plant site. eg. North Point, np]
     --data=/c/path-to-csv.csv
+    --layout=rows [optional, rows or buckets. see log_buckets.py]
+    --mode=insert [optional, insert, skip or upsert. see below]
+    --chunksize=100000 [optional, CSV rows parsed at a time]
+    --batch=10000 [optional, documents per insert_many]
+    --workers=4 [optional, inserts running at once]
+    --checkpoint=/c/load.json [optional, resume file]
+
+Several CSVs, of one or more sites, load in one run with site=path pairs:
+
+    --data np=/c/np-2016.csv np=/c/np-2017.csv insead=/c/insead.csv
+
+The CSV is read in chunks and the documents of a chunk are inserted in
+unordered batches by --workers threads, each on its own connection of the
+client's pool. With --checkpoint, the rows loaded so far are recorded per
+file, and a second run with the same file skips them.
+
+Overlapping exports can be loaded again with --mode=skip (logs already
+loaded are kept) or --mode=upsert (they are replaced by the new rows).
+Both make (_site, timestamp) a unique key of the logs and print the
+inserted, updated and skipped counts. New rows are inserted as fast as
+with --mode=insert.
 
 To implement:
     Add optional arguments to pass username and password of database
@@ -15,9 +36,22 @@ To implement:
 
 import pymongo
 import argparse
+import json
+import os
+import time
 import pandas as pd
 import numpy as np
 import pytz
+import rollups
+import log_buckets
+import indexes
+
+from concurrent.futures import ThreadPoolExecutor
+from pymongo.errors import BulkWriteError
+
+
+# error code of a unique index violation
+DUPLICATE_KEY = 11000
 
 
 parser = argparse.ArgumentParser(description="Load sensor logs into MongoDB from CSV files")
@@ -25,44 +59,185 @@ parser.add_argument("--site", type=str, help="Chiller Plant site ID")
 parser.add_argument("--db", type=str, help="MongoDB database name")
 parser.add_argument("--host", type=str, help="MongoDB Host")
 parser.add_argument("--port", type=int, help="MongoDB Port")
-parser.add_argument("--data", type=str, help="Path to CSV file")
-args = parser.parse_args()
+parser.add_argument("--data", type=str, nargs="+", help="Path to CSV file(s), or site=path pairs")
+parser.add_argument("--layout", type=str, default="rows", choices=["rows", "buckets"],
+                    help="one document per row (default) or per field and day, see log_buckets.py")
+parser.add_argument("--mode", type=str, default="insert", choices=["insert", "skip", "upsert"],
+                    help="insert all rows (default), or skip/replace the logs already loaded")
+parser.add_argument("--chunksize", type=int, default=100000, help="CSV rows parsed at a time")
+parser.add_argument("--batch", type=int, default=10000, help="Documents per insert_many")
+parser.add_argument("--workers", type=int, default=4, help="Inserts running at once")
+parser.add_argument("--checkpoint", type=str, help="File recording the rows loaded, to resume")
+
+
+def read_chunks(path, chunksize, skip=0):
+    """Parse the CSV at path in DataFrames of chunksize rows, skipping the first `skip` rows."""
+    reader = pd.read_csv(path, chunksize=chunksize, skiprows=range(1, skip + 1),
+                         na_values=["\\N"], low_memory=False)
+    for df in reader:
+        df = df.rename(columns={"Time Stamp": "timestamp"})
+
+        # update data types, column by column
+        dtypes = dict([(col, np.float64) for col in df.columns if col != "timestamp"])
+        df = df.astype(dtypes)
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.tz_localize(pytz.UTC)
+        yield df
+
+
+def log_documents(df, site):
+    """Log documents of the rows of df."""
+    return df.assign(_site=site).to_dict("records")
+
+
+class Checkpoint:
+    """Rows loaded per CSV file, kept in a JSON file (no-op without a path)."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.rows = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.rows = json.load(f)
+
+    def get(self, key):
+        return self.rows.get(key, 0)
+
+    def set(self, key, rows):
+        self.rows[key] = rows
+        if self.path:
+            # write and rename, a crash never leaves half a file
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.rows, f)
+            os.replace(self.path + ".tmp", self.path)
+
+
+def insert_documents(collection, docs, mode="insert"):
+    """Insert docs in one unordered batch.
+
+    mode "insert" inserts every document. With a unique (_site, timestamp)
+    index, "skip" leaves the logs already in the collection as they are
+    and "upsert" replaces them. New documents go through insert_many in all
+    modes, only the duplicates are replaced.
+
+    Returns:
+        dict of the inserted, updated and skipped counts and the positions
+        in docs of the duplicates ("duplicates")
+    """
+    try:
+        collection.insert_many(docs, ordered=False)
+        return {"inserted": len(docs), "updated": 0, "skipped": 0, "duplicates": []}
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if mode == "insert" or any(err["code"] != DUPLICATE_KEY for err in errors):
+            raise
+    duplicates = [err["index"] for err in errors]
+    counts = {"inserted": len(docs) - len(duplicates), "updated": 0, "skipped": len(duplicates),
+              "duplicates": duplicates}
+    if mode == "upsert":
+        # insert_many set an _id on every document, the logs keep theirs
+        ops = []
+        for i in duplicates:
+            doc = dict((k, v) for k, v in docs[i].items() if k != "_id")
+            ops.append(pymongo.ReplaceOne({"_site": doc["_site"], "timestamp": doc["timestamp"]}, doc, upsert=True))
+        result = collection.bulk_write(ops, ordered=False)
+        counts["inserted"] += result.upserted_count
+        counts["updated"] = result.modified_count
+        counts["skipped"] = result.matched_count - result.modified_count
+    return counts
+
+
+def load_csv(db, site, path, pool, checkpoint, layout="rows", mode="insert", chunksize=100000, batch=10000):
+    """Load one CSV of a site.
+
+    Returns:
+        dict of the rows read and the inserted, updated and skipped counts
+    """
+    key = "{}={}".format(site, os.path.abspath(path))
+    done = checkpoint.get(key)
+    if done:
+        print("{}: resuming after row {}".format(path, done))
+
+    totals = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0}
+    changed = [] # time ranges of the chunks with updated logs
+
+    # chunks being inserted, (chunk, futures), in file order
+    pending = []
+    def advance(keep):
+        # record the chunks inserted so far, waiting while more than `keep` are pending
+        nonlocal done
+        while pending and (len(pending) > keep or all(f.done() for f in pending[0][1])):
+            df, futures = pending.pop(0)
+            new = np.ones(df.shape[0], dtype=bool)
+            for i, f in enumerate(futures):
+                counts = f.result()
+                new[[i * batch + j for j in counts.pop("duplicates")]] = False
+                for k, v in counts.items():
+                    totals[k] += v
+                if counts["updated"]:
+                    changed.append((df.timestamp.min(), df.timestamp.max()))
+
+            # keep the hourly/daily/monthly/yearly rollups up to date.
+            # skipped and replaced logs are already counted in them.
+            rollups.update_rollups(db, df[new], site)
+            done += df.shape[0]
+            checkpoint.set(key, done)
+
+    skipped = done
+    start = time.time()
+    for df in read_chunks(path, chunksize, skip=skipped):
+        if layout == "buckets":
+            log_buckets.save_buckets(db, df, site)
+            futures = []
+            totals["inserted"] += df.shape[0]
+        else:
+            docs = log_documents(df, site)
+            futures = [pool.submit(insert_documents, db.log, docs[i:i + batch], mode)
+                       for i in range(0, len(docs), batch)]
+
+        # parse the next chunk while this one is inserted
+        pending.append((df, futures))
+        advance(keep=1)
+        totals["rows"] += df.shape[0]
+        print("{}: {} rows, {:.0f} rows/s".format(
+            path, skipped + totals["rows"], totals["rows"] / (time.time() - start)))
+    advance(keep=0)
+
+    # replaced logs changed the sums, rebuild the rollups they fall in
+    if changed:
+        print("Rebuilding the rollups of the updated logs.. ")
+        rollups.backfill(db, site, start=min(t for t, _ in changed).to_pydatetime(),
+                         end=max(t for _, t in changed).to_pydatetime())
+    return totals
 
 
 def main():
-    # load data as dataframe
-    print("Loading data now.. ")
-    df = pd.read_csv(args.data, low_memory=False)
-    df = df.replace("\\N", np.nan)
-    df = df.rename(columns={"Time Stamp": "timestamp"})
-
-    # update data types
-    dtypes = dict([(col, np.float64) for col in df.columns if col != "timestamp"])
-    df = df.astype(dtypes)
-    df.timestamp = pd.to_datetime(df.timestamp)
-    df.timestamp = df.timestamp.apply(lambda t: t.tz_localize(pytz.UTC))
+    args = parser.parse_args()
+    files = [item.split("=", 1) if "=" in item else (args.site, item) for item in args.data]
 
     # connect to database
     print("Connecting to database.. ")
     client = pymongo.MongoClient(host=args.host, port=args.port, tz_aware=True)
     db = client[args.db]
+    indexes.ensure_indexes(db, unique=args.mode != "insert")
+
+    # get chiller plant sites
+    for site in set(site for site, _ in files):
+        if db.site.find_one({"_id": site}) is None:
+            raise Exception("Chiller Plant site ID {} is not found in the database!".format(site))
 
-    # get chiller plant site
-    if db.site.find_one({"_id": args.site}) is None:
-        raise Exception("Chiller Plant site ID is not found in the database!")
-
-    def save_to_db(row):
-        save_to_db.bulk = getattr(save_to_db, "bulk", [])
-        row["_site"] = args.site
-        save_to_db.bulk.append(row.to_dict())
-        if len(save_to_db.bulk) > 30 ** 3 or row.name == len(df)-1:
-            print("Saving at {0}...".format(row.name))
-            db.log.insert_many(save_to_db.bulk)
-            save_to_db.bulk = []
-
-    # Iterate
-    df.apply(save_to_db, axis=1)
-    print("Done!")
+    checkpoint = Checkpoint(args.checkpoint)
+    totals, start = dict.fromkeys(["rows", "inserted", "updated", "skipped"], 0), time.time()
+    with ThreadPoolExecutor(args.workers) as pool:
+        for site, path in files:
+            print("Loading {} into {}.. ".format(path, site))
+            counts = load_csv(db, site, path, pool, checkpoint, args.layout, args.mode, args.chunksize, args.batch)
+            print("{}: {inserted} inserted, {updated} updated, {skipped} skipped".format(path, **counts))
+            for k, v in counts.items():
+                totals[k] += v
+    elapsed = max(time.time() - start, 1e-9)
+    print("Done! {rows} rows in {0:.1f}s, {1:.0f} rows/s. "
+          "{inserted} inserted, {updated} updated, {skipped} skipped".format(
+              elapsed, totals["rows"] / elapsed, **totals))
 
 
 if __name__ == "__main__":
@@ -2,23 +2,26 @@
 import datetime as dt
 import config as cfg
 import numpy as np
-import pandas as pd
 import flask_login as login
 import flask
 import pymongo
 import pytz
-import process
 import forms
+import bucket_cache
+import rollups
+import log_buckets
+import indexes
+import forecaster
+import model_registry
 import os
 
 from flask import json
 from flask import request
-from functools import lru_cache
 
+# pandas, sklearn (process.py) and keras are slow to import, only the
+# endpoints and workers that need them import them (see import_report.py)
 os.environ["KERAS_BACKEND"] = "tensorflow"
 
-from keras.models import load_model, model_from_json
-
 
 app = flask.Flask(__name__)
 login_manager = login.LoginManager()
@@ -36,52 +39,23 @@ class User(login.UserMixin):
         return self.name
 
 
-@lru_cache(maxsize=None)
-def load_keras_model(rel_path):
-    """Load keras h5 model file
-
-    Model is cached in memory and server restart is 
-    necessary to observe any changes to the model file.
-
-    NOTE/IMPORTANT:
-        Model's batch size is updated at runtime. This could
-        potentially break the program.. Keep watching at this.
-
-        Setting batch size to 1 basically makes life easier to
-        build a forecasting model in production settings. If not,
-        we need to ensure prediction data is a factor of batch size..
-        that means, we need to sometimes predict more than neccessary
-        values...
-
-    Args:
-        rel_path  := Relative path to Keras model.
-        backend   := Keras backend
-    Return:
-        Keras model
-    """
-    model_path = os.path.join(app.config["KERAS_MODEL_DIR"], rel_path)
-    model = load_model(model_path)
-
-    # get model architecture, weights, 
-    model_arch = flask.json.loads(model.to_json())
-    model_weights = model.get_weights()
+# aggregated buckets of query_logs, see bucket_cache.BucketCache
+log_cache = bucket_cache.BucketCache(cfg.QUERY_CACHE_SIZE, cfg.QUERY_CACHE_TTL)
 
-    # set batch size to 1.
-    shape = model_arch["config"][0]["config"]["batch_input_shape"]
-    shape[0] = 1
-    model_arch["config"][0]["config"]["batch_input_shape"] = shape
+# hourly_thresholds of the abnormalities API, keyed by
+# (site, field, freq, start of the training days), each counts as one
+threshold_cache = bucket_cache.BucketCache(cfg.THRESHOLD_CACHE_SIZE, cfg.QUERY_CACHE_TTL)
 
-    # load model freshly. tweak the model to set batch size to 1.
-    # NOTE: In production, we want to sometimes forecast just 1 vector.. 
-    model = model_from_json(flask.json.dumps(model_arch))
-    model.set_weights(model_weights)
-
-    return model
 
 
 def query_logs(site, fields, start, end, freq="minutes", aggregate="avg", order=1):
     """Query for Chiller Plants data.
 
+    Closed buckets that lie entirely in (start, end] are served from
+    `log_cache` (for config.QUERY_CACHE_TTL seconds, blocks without logs
+    are not cached) and only the blocks it misses are aggregated. The partial
+    buckets at both ends and the still open ones are aggregated every time.
+
     Args:
         site        := string, Chiller plant ID (eg: insead, np)
         fields      := List, Chiller plant parameters (eg: cwshdr)
@@ -90,32 +64,99 @@ def query_logs(site, fields, start, end, freq="minutes", aggregate="avg", order=
         aggregate   := string, aggregate function to apply
         order       := int, 1 implies ascending, -1 implies descending
     Returns:
-        Pymongo Cursor; Iterate this.
+        List of documents, {"_id": bucket start datetime, field: value, ...}
     """
-    # first filter the logs by timestamp
-    # Assuming timeperiod is going to be relatively smaller than collection size,
-    # the B+ Tree search space would highly reduced in further operations.
-    # Note: Create an index on timestamp
-    step_0 = {
-        "$match": {
-            "timestamp": {"$gt": start, "$lte": end},
-            "_site": site
-        }
-    }
+    bucket = freq
+    block = bucket_cache.BLOCKS[freq]
+    now = dt.datetime.now(pytz.UTC)
+
+    # full and closed buckets are [lo, hi)
+    lo = bucket_cache.next_time(start, bucket)
+    hi = min(bucket_cache.floor_time(end, bucket), bucket_cache.floor_time(now, block))
+    if lo >= hi:
+        return list(aggregate_logs(site, fields, [{"$gt": start, "$lte": end}], freq, aggregate, order))
+
+    # cached blocks, and runs of consecutive blocks missed for any field
+    blocks, runs = [], []
+    t = bucket_cache.floor_time(lo, block)
+    while t < hi:
+        t_next = bucket_cache.next_time(t, block)
+        entries = dict((f, log_cache.get((site, f, freq, aggregate, t))) for f in fields)
+        if None in entries.values():
+            if runs and runs[-1][1] == t:
+                runs[-1][1] = t_next
+            else:
+                runs.append([t, t_next])
+        blocks.append((t, entries))
+        t = t_next
+
+    # aggregate the missed blocks as a whole and cache them
+    if runs:
+        filled = {}
+        ranges = [{"$gte": a, "$lt": b} for a, b in runs]
+        for doc in aggregate_logs(site, fields, ranges, freq, aggregate, 1):
+            t = doc["_id"]
+            for f in fields:
+                filled.setdefault((f, bucket_cache.floor_time(t, block)), []).append((t, doc.get(f)))
+        for t, entries in blocks:
+            for f in fields:
+                if entries[f] is None:
+                    entries[f] = filled.get((f, t), [])
+                    # a block without logs may still be loaded (csv2mongo.py)
+                    if entries[f]:
+                        log_cache.put((site, f, freq, aggregate, t), entries[f])
+
+    # partial and open buckets
+    results = {}
+    edges = [{"$gt": start, "$lt": lo}, {"$gte": hi, "$lte": end}]
+    for doc in aggregate_logs(site, fields, edges, freq, aggregate, order):
+        results[doc["_id"]] = doc
+
+    for t, entries in blocks:
+        for f in fields:
+            for t, value in bucket_cache.entry_range(entries[f], lo, hi):
+                if t not in results:
+                    results[t] = dict([("_id", t)] + [(g, None) for g in fields])
+                results[t][f] = value
+
+    return [results[i] for i in sorted(results, reverse=order == -1)]
+
+
+def aggregate_logs(site, fields, ranges, freq="minutes", aggregate="avg", order=1):
+    """Aggregate the logs of a site in buckets of `freq`.
 
-    # used to group data by timestamp
-    dt_format = {
-        "years"   : "%Y-01-01T00:00:00.000",
-        "months"  : "%Y-%m-01T00:00:00.000",
-        "days"    : "%Y-%m-%dT00:00:00.000",
-        "hours"   : "%Y-%m-%dT%H:00:00.000",
-        "minutes" : "%Y-%m-%dT%H:%M:%S.000"
-    }
+    Args:
+        ranges      := List of timestamp conditions (eg: {"$gt": start, "$lte": end})
+        others      := see query_logs
+    Returns:
+        Iterable of documents, {"_id": bucket start datetime, field: value, ...}
+    """
+    # logs stored in the bucket layout are aggregated in numpy
+    if cfg.LOG_LAYOUT == "buckets":
+        return aggregate_log_buckets(site, fields, ranges, freq, aggregate, order)
 
-    # Now, group the documents with timestamp and `group_by` as format
-    group_by = dt_format.get(freq)
-    step_1 = {
-        "$group": {"_id": {"$dateToString": {"format": group_by, "date": "$timestamp"}}}}
+    # whole hours and coarser buckets are read from the rollups, unless
+    # they were not backfilled yet
+    db = app.config["db"]
+    if cfg.USE_ROLLUPS and freq in rollups.UNITS and rollups.covers(db, site):
+        return rollups.aggregate(db, site, fields, ranges, freq, aggregate, order)
+
+    return db.log.aggregate(logs_pipeline(site, fields, ranges, freq, aggregate, order))
+
+
+def logs_pipeline(site, fields, ranges, freq="minutes", aggregate="avg", order=1):
+    """Aggregation pipeline of aggregate_logs on the raw logs (see aggregate_logs)."""
+    # first filter the logs by site and timestamp.
+    # this is an IXSCAN on the (_site, timestamp) index, see indexes.py
+    step_0 = {"$match": {"_site": site}}
+    if len(ranges) == 1:
+        step_0["$match"]["timestamp"] = ranges[0]
+    else:
+        step_0["$match"]["$or"] = [{"timestamp": r} for r in ranges]
+
+    # Now, group the documents by their timestamp truncated to `freq`.
+    # the bucket comes back as a datetime, no formatting and parsing.
+    step_1 = {"$group": {"_id": bucket_cache.trunc_expr(freq)}}
 
     # Apply aggregate on all the `fields`
     # Eg: "$group": { "cwshdr": { "avg": "$cwshdr" } }
@@ -125,16 +166,101 @@ def query_logs(site, fields, start, end, freq="minutes", aggregate="avg", order=
 
     # sort the data..
     step_2 = {"$sort": {"_id": order}}
+    return [step_0, step_1, step_2]
+
 
-    # query data
+# numpy datetime unit of each freq
+NP_UNITS = {"years": "Y", "months": "M", "days": "D", "hours": "h", "minutes": "m"}
+
+
+def aggregate_log_buckets(site, fields, ranges, freq="minutes", aggregate="avg", order=1):
+    """aggregate_logs for logs stored in the bucket layout (see log_buckets.py).
+
+    The bucket documents covering `ranges` are decoded into numpy arrays
+    and aggregated there. Missing values are skipped.
+    """
+    lows = [r.get("$gt", r.get("$gte")) for r in ranges]
+    highs = [r.get("$lt", r.get("$lte")) for r in ranges]
+    query = {
+        "_site": site,
+        "field": {"$in": list(fields)},
+        "timestamp": {"$gte": bucket_cache.floor_time(min(lows), log_buckets.UNIT), "$lte": max(highs)}
+    }
+    chunks = dict((f, []) for f in fields)
     db = app.config["db"]
-    cursor = db.log.aggregate([step_0, step_1, step_2])
-    
-    # Let's give the calling function the freedom to 
-    # query the way.. he wants. Why burden with O(N)..
-    return cursor
-    
-    
+    for doc in db[log_buckets.COLLECTION].find(query):
+        chunks[doc["field"]].append(log_buckets.decode(doc))
+
+    compare = {"$gt": np.greater, "$gte": np.greater_equal, "$lt": np.less, "$lte": np.less_equal}
+    stats = {}
+    for f, parts in chunks.items():
+        if not parts:
+            continue
+        times = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+
+        keep = np.zeros(len(times), dtype=bool)
+        for r in ranges:
+            cond = np.ones(len(times), dtype=bool)
+            for op, t in r.items():
+                cond &= compare[op](times, np.datetime64(log_buckets.to_naive(t), "ms"))
+            keep |= cond
+        if not keep.any():
+            continue
+
+        # sum, count, min and max per bucket of freq
+        buckets = times[keep].astype("datetime64[{}]".format(NP_UNITS[freq]))
+        values = values[keep]
+        idx = np.argsort(buckets, kind="stable")
+        buckets, values = buckets[idx], values[idx]
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        valid = ~np.isnan(values)
+        stats[f] = dict(zip(buckets[starts].astype("datetime64[ms]").tolist(), zip(
+            np.add.reduceat(np.where(valid, values, 0), starts).tolist(),
+            np.add.reduceat(valid, starts).tolist(),
+            np.fmin.reduceat(values, starts).tolist(),
+            np.fmax.reduceat(values, starts).tolist())))
+
+    results = []
+    keys = set().union(*stats.values()) if stats else set()
+    for t in sorted(keys, reverse=order == -1):
+        doc = {"_id": t.replace(tzinfo=pytz.UTC)}
+        for f in fields:
+            total, count, low, high = stats.get(f, {}).get(t, (0.0, 0, None, None))
+            doc[f] = {
+                "avg": total / count if count else None,
+                "sum": total,
+                "min": low if count else None,
+                "max": high if count else None
+            }[aggregate]
+        results.append(doc)
+    return results
+
+
+def logs_dataframe(docs, fields, names=None):
+    """Build a DataFrame from query_logs documents in one go.
+
+    Args:
+        docs    := Iterable of query_logs documents
+        fields  := List, fields to keep (in this order)
+        names   := List, column names of the fields (default fields)
+    Returns:
+        pandas DataFrame with the (naive UTC) bucket timestamp as index
+    """
+    import pandas as pd
+
+    df = pd.DataFrame.from_records(docs, columns=["_id"] + fields)
+    df.columns = ["timestamp"] + (names or fields)
+    df = df.set_index("timestamp")
+    df.index = pd.DatetimeIndex(df.index).tz_localize(None)
+    return df
+
+
+def fetch_logs(site, fields, start, end):
+    """Minute logs of a site in (start, end] as a DataFrame (see logs_dataframe)."""
+    return logs_dataframe(query_logs(site, fields, start, end, "minutes", "avg"), fields)
+
+
 def preprocess_flow_1(df, cols):
     """Preprocess chiller plant logs.
 
@@ -143,44 +269,62 @@ def preprocess_flow_1(df, cols):
     Returns:
         Processed pandas dataframe
     """
-    df = process.replace_nulls(df, cols=cols)
-    df = process.replace_with_near(df, cols=cols)
-    df = process.smooth_data(df, cols=cols)
-    return df
+    import process
 
+    return process.preprocess_pipeline(df, cols=cols)
 
-def find_frequency_based_abnormalities(train, test, limit=(0.1, 0.9), delta=10, field="value"):
-    """Find abnormalities using frequency per hour of past values.
+
+def hourly_thresholds(train, limit=(0.1, 0.9), delta=10, field="value"):
+    """Thresholds of the rate of change per hour of the day.
 
     Args:
         train   := pandas DataFrame used for calculating frequencies
-        test    := pandas DataFrame to find abnormalities
         limit   := tuple, (min, max) threshold quartiles
         delta   := int, sensitivity in calculating rate of change
-        field   := string, field value in train/test on which abnormalities are found
+        field   := string, field value in train on which thresholds are found
+    Returns:
+        numpy array (24, 2), (min, max) rate of each hour. NaN for the hours
+        without data in `train`
+    """
+    if train.shape[0] == 0:
+        return np.full((24, 2), np.nan)
+
+    # rate of change
+    rate = (train[field] - train[field].shift(delta)).fillna(0)
+
+    # upper and lower limits grouped by hour, in one pass
+    quantiles = rate.groupby(train.index.hour).quantile(list(limit)).unstack()
+    return quantiles.reindex(index=range(24), columns=list(limit)).values
+
+
+def find_frequency_based_abnormalities(train, test, limit=(0.1, 0.9), delta=10, field="value",
+                                       thresholds=None):
+    """Find abnormalities using frequency per hour of past values.
+
+    Args:
+        train       := pandas DataFrame used for calculating frequencies
+        test        := pandas DataFrame to find abnormalities
+        limit       := tuple, (min, max) threshold quartiles
+        delta       := int, sensitivity in calculating rate of change
+        field       := string, field value in train/test on which abnormalities are found
+        thresholds  := hourly_thresholds of train, if already known (train is not used then)
     Returns:
-        pandas Series, with `test` index, value represents abnormal or not
+        pandas DataFrame, with `test` index, "abnormal" column represents abnormal or not
     """
     if test.shape[0] == 0:
         return test[field]
-
-    # hours
-    train["hour"] = train.index.hour
-    test["hour"] = test.index.hour
+    if thresholds is None:
+        thresholds = hourly_thresholds(train, limit, delta, field)
 
     # rate of change
-    train["rate"] = (train[field] - train[field].shift(delta)).fillna(0)
     test["rate"] = (test[field] - test[field].shift(delta)).fillna(0)
 
-    # upper and lower limits grouped by hour
-    min_per_hr = train.groupby(["hour"]).quantile(limit[0]).rate
-    max_per_hr = train.groupby(["hour"]).quantile(limit[1]).rate
-
-    # max and min limits of test data (based on train data)
-    test["min_rate"] = test.hour.apply(lambda x: min_per_hr.iloc[int(x)])
-    test["max_rate"] = test.hour.apply(lambda x: max_per_hr.iloc[int(x)])
+    # max and min limits of test data (based on train data), by hour of the day
+    hours = test.index.hour.values
+    test["min_rate"] = thresholds[hours, 0]
+    test["max_rate"] = thresholds[hours, 1]
 
-    # is this abnormal?
+    # is this abnormal? (never in the hours train has no data of)
     test["abnormal"] = (test.rate < test.min_rate) | (test.rate > test.max_rate)
 
     return test[ ["min_rate", "max_rate", "abnormal", "rate"] ]
@@ -211,40 +355,39 @@ def frequency_based_abnormalities_api(site):
         end=form.end.data,
         freq=form.freq.data,
         aggregate="avg")
-    data = [
-        (i[form.field.data], dt.datetime.strptime(i["_id"], "%Y-%m-%dT%H:%M:%S.%f"))
-        for i in test_data_query
-    ]
-
-    test_df = pd.DataFrame(data, columns=("value", "timestamp")).set_index("timestamp")
+    test_df = logs_dataframe(test_data_query, [form.field.data], names=["value"])
     test_df = preprocess_flow_1(test_df, cols=["value"])
 
-    # get data to calculate frequencies (last 15 days.. )
+    # thresholds of the past days, cached once those days are over
     lookback = 30
-    train_data_query = query_logs(
-        site=site,
-        fields=[form.field.data],
-        start=form.start.data - dt.timedelta(days=lookback),
-        end=form.start.data,
-        freq=form.freq.data,
-        aggregate="avg")
-    data = [
-        (i[form.field.data], dt.datetime.strptime(i["_id"], "%Y-%m-%dT%H:%M:%S.%f"))
-        for i in train_data_query
-    ]
-    train_df = pd.DataFrame(data, columns=("value", "timestamp")).set_index("timestamp")
-    train_df = preprocess_flow_1(train_df, cols=["value"])
+    train_start = form.start.data - dt.timedelta(days=lookback)
+    key = (site, form.field.data, form.freq.data, train_start)
+    thresholds = threshold_cache.get(key)
+    if thresholds is None:
+        train_data_query = query_logs(
+            site=site,
+            fields=[form.field.data],
+            start=train_start,
+            end=form.start.data,
+            freq=form.freq.data,
+            aggregate="avg")
+        train_df = logs_dataframe(train_data_query, [form.field.data], names=["value"])
+        train_df = preprocess_flow_1(train_df, cols=["value"])
+        thresholds = hourly_thresholds(train_df)
+        # expire like log_cache, nothing is cached until the days are logged
+        if train_df.shape[0] > 0 and form.start.data <= dt.datetime.now(pytz.UTC):
+            threshold_cache.put(key, thresholds, cost=1)
 
     # find abnormalities
-    resp_df = find_frequency_based_abnormalities(train_df, test_df)
+    resp_df = find_frequency_based_abnormalities(None, test_df, thresholds=thresholds)
 
     # prepare response
     results = []
     for idx, r1, r2 in zip(test_df.index, resp_df.values, test_df.value.values):
         results.append({
             "_id": idx.strftime("%Y-%m-%dT%H:%M:%S.%f"),
-            "min_value": r1[0],
-            "max_value": r1[1],
+            "min_value": None if np.isnan(r1[0]) else r1[0],
+            "max_value": None if np.isnan(r1[1]) else r1[1],
             "abnormal": r1[2],
             "value": r2, # this value is "preprocessed" one. Its not "exactly" same as original.
             "rate": r1[3]
@@ -298,6 +441,9 @@ def logs_api(site):
         aggregate=form.func.data,
         order=form.order.data)
     results = [i for i in cursor]
+    last_id = results[-1]["_id"] if results else None
+    for i in results:
+        i["_id"] = i["_id"].strftime("%Y-%m-%dT%H:%M:%S.000")
 
     # send the query parameters as reference (not the parsed ones...)
     params = form.data
@@ -313,8 +459,7 @@ def logs_api(site):
     # send the id of last result as page token.. but change its format
     # just to make it look like a token :p
     if len(results) > 0:
-        token_id = dt.datetime.strptime(results[-1]["_id"], "%Y-%m-%dT%H:%M:%S.%f")
-        response["nextPageToken"] = token_id.strftime(form.TOKEN_FMT)
+        response["nextPageToken"] = last_id.strftime(form.TOKEN_FMT)
 
     return json.jsonify(response)
 
@@ -334,8 +479,10 @@ def forecast_api(site):
             4. model file name (present in the same directory)
 
     Other notes:
-        This is *not* production ready yet. It's so much good to presist this
-        data somewhere instead of predicting at each call..
+        The forecast worker (forecaster.py) runs the models over the logs as
+        they arrive, in large batches, and this API reads the stored
+        forecasts. Windows the stored forecasts do not cover (eg. logs loaded
+        before the worker ran) are forecast here, normalized as a whole.
 
     Args:
         site    := Chiller Plant ID (eg: insead)
@@ -349,78 +496,18 @@ def forecast_api(site):
     if not form.validate():
         return flask.make_response(json.jsonify(**form.errors), 400)
 
-    # load model parameters
-    config_file = os.path.join(app.config["KERAS_MODEL_DIR"], "config.json")
-    model_config_list = flask.json.load(open(config_file, "rb"))
-
     # search for required configuration..
-    model = None
-    model_config = None
-    for c in model_config_list:
-        if c["target"].lower() == form.field.data.lower():
-            model_file_pth = os.path.join(app.config["KERAS_MODEL_DIR"], c["model_name"])
-            model = load_keras_model(model_file_pth)
-            model_config = c
-    if model is None:
+    model_config = app.config["models"].config(form.field.data)
+    if model_config is None:
         response = {"message": "Forecast model not found"}
         return flask.make_response(response, 400)
 
-    lookback = model_config["lookback"]
-    features = model_config["features"] # order is imp!!
-    target = [model_config["target"]]
-
-    # query enough data...
-    # NOTE: Forecast models are trained with "minutes" frequency.. 
-    # Using other frequency is may lead to inaccurate results.
-    data_query = query_logs(
-        site=site,
-        fields=features+target,
-        start=form.start.data - dt.timedelta(**{form.freq.data: lookback}),
-        end=form.end.data,
-        freq=form.freq.data,
-        aggregate="avg")
-    data = []
-    for i in data_query:
-        i["timestamp"] = i.pop("_id")
-        i["timestamp"] = dt.datetime.strptime(i["timestamp"], "%Y-%m-%dT%H:%M:%S.%f")
-        data.append(i)
-
-    columns = features + target + ["timestamp"]
-    df = pd.DataFrame(data, columns=columns).set_index("timestamp")
-
-    # preprocess this data..
-    if df.shape[0] > 0:
-        df = process.replace_nulls(df, cols=features+target)
-        df = process.replace_with_near(df, cols=features+target)
-        df = process.get_normalized_df(df, cols=features+target)
-
-    # prepare input vectors for forecast model
-    X, y = process.prepare_features(df, features, target, lookback)
-    X = process.Reshape.x(X)
-    y = process.Reshape.y(y)
-
-    # may the model forecast as good as a saint....
-    predict_y = model.predict(X, batch_size=1) if X.shape[0] > 0 else np.array([])
-    predict_y = process.Reshape.inv_y(predict_y)
-
-    if df.shape[0] > 0:
-        # inverse normalize
-        target_idx = -1 # the index of target vector in `features+target`
-        predict_y -= df.scaler.min_[target_idx]
-        predict_y /= df.scaler.scale_[target_idx]
-
-        df[target] -= df.scaler.min_[target_idx]
-        df[target] /= df.scaler.scale_[target_idx]
-
-    # prepare response
-    results = []
-    df = df[lookback:] # we retrieved little extra.. 
-    for idx, t, y in zip(df.index, df[target].values, predict_y):
-        results.append({
-            "_id": idx.strftime("%Y-%m-%dT%H:%M:%S.%f"),
-            "value": float(t[0]),
-            "predicted": float(y),
-        })
+    db = app.config["db"]
+    if not forecaster.covers(db, site, model_config["target"], form.start.data, form.end.data,
+                             model_config["lookback"]):
+        results = forecast_window(site, model_config, form.start.data, form.end.data, form.freq.data)
+    else:
+        results = stored_forecasts(site, model_config, form.start.data, form.end.data, form.freq.data)
 
     params = form.data
     params["start"] = form.start._data
@@ -435,6 +522,84 @@ def forecast_api(site):
     return json.jsonify(response)
 
 
+def stored_forecasts(site, model_config, start, end, freq):
+    """Forecasts of the forecast worker in [start, end], aggregated to freq."""
+    # NOTE: Forecast models are trained with "minutes" frequency..
+    step_0 = {"$match": {
+        "_site": site,
+        "target": model_config["target"],
+        "timestamp": {"$gte": start, "$lte": end}
+    }}
+    step_1 = {"$group": {
+        "_id": bucket_cache.trunc_expr(freq),
+        "value": {"$avg": "$value"},
+        "predicted": {"$avg": "$predicted"}
+    }}
+    step_2 = {"$sort": {"_id": 1}}
+    db = app.config["db"]
+
+    results = []
+    for doc in db[forecaster.COLLECTION].aggregate([step_0, step_1, step_2]):
+        results.append({
+            "_id": doc["_id"].strftime("%Y-%m-%dT%H:%M:%S.%f"),
+            "value": doc["value"],
+            "predicted": doc["predicted"],
+        })
+    return results
+
+
+def forecast_window(site, model_config, start, end, freq):
+    """Forecast the minute logs in [start, end] now, aggregated to freq.
+
+    The logs of the window are normalized together, as this API did before
+    the forecasts were stored. Nothing is stored, the worker does that.
+    """
+    import pandas as pd
+
+    model = app.config["models"].get(model_config["model_name"])
+    forecast = forecaster.forecast_logs(
+        model, fetch_logs, site, model_config, start, end, cfg.FORECAST_BATCH_SIZE)
+    if forecast is None:
+        return []
+
+    index, values, predicted = forecast
+    df = pd.DataFrame({"value": values, "predicted": predicted}, index=index)
+    df = df[df.index >= start.replace(tzinfo=None)]
+    buckets = [bucket_cache.floor_time(t, freq) for t in df.index.to_pydatetime()]
+
+    # averages skip missing values, like $avg over the stored forecasts
+    results = []
+    for t, row in df.groupby(buckets).mean().iterrows():
+        results.append({
+            "_id": t.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+            "value": None if np.isnan(row["value"]) else row["value"],
+            "predicted": row["predicted"],
+        })
+    return results
+
+
+@app.route("/api/v1/cache", methods=["GET"])
+@login.login_required
+def cache_api():
+    """Hit/miss counters of the query_logs cache."""
+    response = {
+        "results": log_cache.stats(),
+        "apiVersion": "v1"
+    }
+    return json.jsonify(response)
+
+
+@app.route("/api/v1/models", methods=["GET"])
+@login.login_required
+def models_api():
+    """Load time, memory and calls of the forecast models."""
+    response = {
+        "results": app.config["models"].stats(),
+        "apiVersion": "v1"
+    }
+    return json.jsonify(response)
+
+
 @app.route("/api/info")
 @login.login_required
 def api_info_page():
@@ -473,6 +638,20 @@ def dashboard_page(view_type):
     return flask.render_template("{}.html".format(view_type))
 
 
+def prewarm():
+    """Import the forecasting modules and load the forecast models.
+
+    Otherwise the first forecast of a process pays for them. Call it once
+    the app is configured, eg. from gunicorn's post_fork hook
+    (config.PREWARM_FORECAST does it for `python dashboard.py`).
+    """
+    import process  # pandas and sklearn
+
+    models = app.config["models"]
+    for model_config in models.configs():
+        models.get(model_config["model_name"])
+
+
 if __name__ == "__main__":
     # create mongodb client
     client = pymongo.MongoClient(tz_aware=True)
@@ -483,9 +662,25 @@ if __name__ == "__main__":
     app.config["db"] = client[cfg.DATABASE["db"]]
     app.config["KERAS_MODEL_DIR"] = \
         os.path.abspath(os.path.join(os.path.dirname(__file__), "ml_models"))
+    app.config["models"] = model_registry.ModelRegistry(
+        app.config["KERAS_MODEL_DIR"], forecaster.load_model, cfg.MODEL_MEMORY_BUDGET)
 
     # setup login manager
     login_manager.init_app(app)
     login_manager.login_view = "login_page"
 
+    # the reloader of debug mode runs this script in a watcher process too,
+    # only the process serving the app creates indexes and forecasts
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        indexes.ensure_indexes(app.config["db"])
+
+        if cfg.PREWARM_FORECAST:
+            prewarm()
+
+        # forecast the new logs in the background
+        if cfg.FORECAST_INTERVAL:
+            forecast_worker = forecaster.ForecastWorker(
+                app.config["db"], app.config["models"], fetch_logs)
+            forecast_worker.start(cfg.FORECAST_INTERVAL)
+
     app.run(debug=True)
@@ -0,0 +1,287 @@
+"""Script: Background forecasting worker.
+
+Runs the models of ml_models/config.json over the logs as they arrive and
+stores the predictions in the forecast collection, next to the logs.
+/api/v1/forecast only reads this collection.
+
+    forecast    {"_site": "np", "target": "cwshdr", "timestamp": <minute>,
+                 "value": <logged value>, "predicted": <forecast>, "model": "cwshdr2.h5"}
+
+The worker forecasts a day of minutes at a time, the same way the API used
+to forecast a request: the logs of the day (and the `lookback` logs before
+it) are preprocessed and normalized together and predicted in batches of
+config.FORECAST_BATCH_SIZE. The day still being logged is forecast again at
+every run. dashboard.py runs the worker in a thread every
+config.FORECAST_INTERVAL seconds. It picks up after the last stored forecast
+(or config.FORECAST_HISTORY_DAYS ago), older logs are backfilled with --start.
+To run it once, eg. after loading logs:
+
+python forecaster.py
+    --db=dashboard [database name]
+    --host=localhost [database host name]
+    --port=27017 [database port name]
+    --site=np --[optional, chiller plant sites to forecast. default all]
+    --start=2017-01-01 [optional, %Y-%m-%d, forecast the logs from this date]
+    --end=2017-02-01 [optional, %Y-%m-%d, forecast the logs up to this date]
+
+The API used to normalize the logs of the requested window, the stored
+forecasts are normalized a day at a time, so they differ slightly from the
+old responses. /api/v1/forecast still forecasts the requested window itself
+when the stored forecasts do not cover it (see covers).
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pymongo
+import pytz
+
+import config as cfg
+import numpy_lstm
+from bucket_cache import floor_time, next_time
+from model_registry import ModelRegistry
+
+
+COLLECTION = "forecast"
+
+
+def ensure_indexes(db):
+    """One forecast per site, target and minute."""
+    db[COLLECTION].create_index(
+        [("_site", pymongo.ASCENDING), ("target", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)],
+        unique=True)
+
+
+def batch_model(model_path, batch_size=None):
+    """Load a keras model for batched prediction.
+
+    The batch dimension of the input becomes variable and recurrent layers
+    stateless, so any number of windows are predicted in one call. With a
+    batch_size, the batch dimension is fixed to it instead (and stateful
+    layers stay stateful).
+    """
+    # keras is slow to import, only the processes forecasting load it
+    from keras.models import load_model, model_from_json
+
+    model = load_model(model_path)
+    model_arch = json.loads(model.to_json())
+    model_weights = model.get_weights()
+
+    layers = model_arch["config"]
+    if isinstance(layers, dict):
+        layers = layers["layers"]
+    layers[0]["config"]["batch_input_shape"][0] = batch_size
+    for layer in layers:
+        if "stateful" in layer["config"] and batch_size is None:
+            layer["config"]["stateful"] = False
+
+    model = model_from_json(json.dumps(model_arch))
+    model.set_weights(model_weights)
+    return model
+
+
+def load_model(model_path):
+    """Model of a .npz file (see numpy_lstm.py) or batch_model of a keras file."""
+    if model_path.endswith(".npz"):
+        return numpy_lstm.load(model_path)
+    return batch_model(model_path)
+
+
+def predict(model, df, features, target, lookback, batch_size):
+    """Forecast target for the rows of df after the first `lookback` ones.
+
+    df is preprocessed and normalized like /api/v1/forecast always did.
+
+    Returns:
+        (timestamps, logged values, predictions) of those rows
+    """
+    # pandas and sklearn are slow to import, the dashboard only needs them here
+    import process
+
+    cols = features + [target]
+    df = process.preprocess_pipeline(df, steps=("replace_nulls", "replace_with_near"), cols=cols)
+    df = process.get_normalized_df(df, cols=cols)
+
+    X, _ = process.prepare_features(df, features, [target], lookback)
+    predicted = model.predict(process.Reshape.x(X), batch_size=batch_size)
+    predicted = process.Reshape.inv_y(predicted)
+
+    # inverse normalize, target is the last column
+    scale, low = df.scaler.scale_[-1], df.scaler.min_[-1]
+    predicted = (predicted - low) / scale
+    values = (df[target].values[lookback:] - low) / scale
+    return df.index[lookback:], values, predicted
+
+
+def forecast_logs(model, fetch, site, config, start, end, batch_size):
+    """Forecast config's target in (start, end] with the logs returned by fetch.
+
+    Returns:
+        (timestamps, logged values, predictions) as predict, None when there
+        are no more than `lookback` logs
+    """
+    lookback = config["lookback"]
+    features, target = config["features"], config["target"]
+    df = fetch(site, features + [target], start - dt.timedelta(minutes=2 * lookback), end)
+
+    # `lookback` logs before start, even if some of those minutes were not logged
+    history = (df.index <= start.replace(tzinfo=None)).sum()
+    df = df.iloc[max(history - lookback, 0):]
+    if df.shape[0] <= lookback:
+        return None
+    return predict(model, df, features, target, lookback, batch_size)
+
+
+def covers(db, site, target, start, end, lookback):
+    """True if the forecasts hold the first and the last logged minute in (start, end].
+
+    Like the worker, the window leaves out start (forecast with the day
+    before it). The first `lookback` minutes of a site's logs have no
+    forecast (there is nothing to look back on), the window starts after them.
+    """
+    first = db.log.find_one({"_site": site}, {"timestamp": 1}, sort=[("timestamp", pymongo.ASCENDING)])
+    if first is None:
+        return True
+    start = max(start, first["timestamp"] + dt.timedelta(minutes=lookback))
+    for direction in (pymongo.ASCENDING, pymongo.DESCENDING):
+        log = db.log.find_one(
+            {"_site": site, "timestamp": {"$gt": start, "$lte": end}}, {"timestamp": 1},
+            sort=[("timestamp", direction)])
+        if log is None:
+            return True
+        minute = floor_time(log["timestamp"], "minutes")
+        if db[COLLECTION].find_one({"_site": site, "target": target, "timestamp": minute}, {"_id": 1}) is None:
+            return False
+    return True
+
+
+class ForecastWorker:
+    """Forecasts the new logs of every site and configured model.
+
+    Args:
+        db          := MongoDB database
+        models      := model_registry.ModelRegistry of the models to run
+        fetch       := function(site, fields, start, end) returning the
+                       minute logs in (start, end] as a DataFrame with the
+                       naive UTC timestamp as index (see dashboard.fetch_logs)
+        sites       := List of site IDs, default all sites of the database
+    """
+
+    def __init__(self, db, models, fetch, sites=None, batch_size=None):
+        self.db = db
+        self.models = models
+        self.fetch = fetch
+        self.sites = sites
+        self.batch_size = batch_size or cfg.FORECAST_BATCH_SIZE
+        self.rows = 0
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, now=None, start=None, end=None):
+        """Forecast the logs that arrived since the last run.
+
+        Args:
+            start   := datetime, forecast the logs from here instead, eg. to
+                       backfill the logs loaded before the worker ran
+            end     := datetime, forecast the logs up to here, default now
+        Returns:
+            Number of forecasts stored
+        """
+        now = now or dt.datetime.now(pytz.UTC)
+        end = min(end, now) if end else now
+        sites = self.sites or [s["_id"] for s in self.db.site.find({}, {"_id": 1})]
+        stored = 0
+        for site in sites:
+            # one model per target, the one /api/v1/forecast would pick
+            targets = dict((c["target"].lower(), c) for c in self.models.configs())
+            for config in targets.values():
+                first = start
+                if first is None:
+                    last = self.db[COLLECTION].find_one(
+                        {"_site": site, "target": config["target"]}, sort=[("timestamp", pymongo.DESCENDING)])
+                    first = last["timestamp"] if last else now - dt.timedelta(days=cfg.FORECAST_HISTORY_DAYS)
+
+                # whole days, the last one is forecast again as it fills up
+                day = floor_time(first, "days")
+                while day < end:
+                    stored += self.forecast(site, config, day, min(next_time(day, "days"), end))
+                    day = next_time(day, "days")
+        return stored
+
+    def forecast(self, site, config, start, end):
+        """Forecast config's target in (start, end] and store it."""
+        t0 = time.time()
+        forecast = forecast_logs(
+            self.models.get(config["model_name"]), self.fetch, site, config, start, end, self.batch_size)
+        if forecast is None:
+            return 0
+        index, values, predicted = forecast
+        self.seconds += time.time() - t0
+        self.rows += len(predicted)
+        target = config["target"]
+
+        ops = []
+        for t, value, y in zip(index.to_pydatetime(), values.tolist(), predicted.tolist()):
+            key = {"_site": site, "target": target, "timestamp": t.replace(tzinfo=pytz.UTC)}
+            doc = dict(key, value=None if np.isnan(value) else value, predicted=y, model=config["model_name"])
+            ops.append(pymongo.ReplaceOne(key, doc, upsert=True))
+        self.db[COLLECTION].bulk_write(ops, ordered=False)
+        return len(ops)
+
+    def start(self, interval):
+        """Run the worker every `interval` seconds in a daemon thread."""
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print("Forecast worker failed: {}".format(e))
+                self._stop.wait(interval)
+        self._thread = threading.Thread(target=loop, name="forecast-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "seconds": self.seconds,
+            "rows_per_second": self.rows / self.seconds if self.seconds else None
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forecast the new logs and store the predictions")
+    parser.add_argument("--site", type=str, nargs="*", help="Chiller Plant site IDs, default all")
+    parser.add_argument("--db", type=str, help="MongoDB database name")
+    parser.add_argument("--host", type=str, help="MongoDB Host")
+    parser.add_argument("--port", type=int, help="MongoDB Port")
+    parser.add_argument("--start", type=str, help="Forecast the logs from this date (%%Y-%%m-%%d)")
+    parser.add_argument("--end", type=str, help="Forecast the logs up to this date (%%Y-%%m-%%d)")
+    args = parser.parse_args()
+    start, end = [dt.datetime.strptime(d, "%Y-%m-%d").replace(tzinfo=pytz.UTC) if d else None
+                  for d in (args.start, args.end)]
+
+    # the logs are read through the dashboard's query_logs
+    import dashboard
+
+    client = pymongo.MongoClient(host=args.host, port=args.port, tz_aware=True)
+    dashboard.app.config["db"] = db = client[args.db]
+    ensure_indexes(db)
+
+    model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml_models")
+    models = ModelRegistry(model_dir, load_model, cfg.MODEL_MEMORY_BUDGET)
+    worker = ForecastWorker(db, models, dashboard.fetch_logs, sites=args.site)
+    print("Stored {} forecasts".format(worker.run_once(start=start, end=end)))
+    print(worker.stats())
+
+
+if __name__ == "__main__":
+    main()
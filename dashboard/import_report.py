@@ -0,0 +1,71 @@
+"""Script: Import cost of the dashboard.
+
+Imports a module in a fresh interpreter (python -X importtime) and prints
+the time spent importing each top level package, slowest first, with the
+peak memory of that interpreter. A gunicorn worker pays this on startup.
+
+python import_report.py
+    --module=dashboard [optional, module to import]
+    --top=15 [optional, packages to print]
+    --forbid tensorflow keras [optional, exits with status 1 if imported]
+
+dashboard.py only imports pandas, sklearn and keras in the endpoints and
+workers that use them, none of them should show up here.
+"""
+
+import argparse
+import collections
+import os
+import resource
+import subprocess
+import sys
+
+
+def import_times(module):
+    """Seconds spent importing each top level package when importing module.
+
+    Returns:
+        (OrderedDict of package -> seconds, slowest first, peak RSS in bytes)
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise Exception("import {} failed:\n{}".format(module, proc.stderr))
+
+    # lines are "import time: <self us> | <cumulative us> | <indented name>",
+    # the self times of a package's modules add up to its cost
+    times = collections.Counter()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip().split(".")[0]] += int(self_us) / 1e6
+
+    # ru_maxrss is in kilobytes on linux, the only child is the interpreter above
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return collections.OrderedDict(times.most_common()), rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the import cost of a module")
+    parser.add_argument("--module", type=str, default="dashboard", help="Module to import")
+    parser.add_argument("--top", type=int, default=15, help="Packages to print")
+    parser.add_argument("--forbid", type=str, nargs="*", default=[], help="Packages that must not be imported")
+    args = parser.parse_args()
+
+    times, rss = import_times(args.module)
+    print("import {}: {:.2f}s, {} packages, peak RSS {:.0f} MB".format(
+        args.module, sum(times.values()), len(times), rss / 2 ** 20))
+    for name, seconds in list(times.items())[:args.top]:
+        print("  {:<24} {:.3f}s".format(name, seconds))
+
+    imported = [name for name in args.forbid if name in times]
+    if imported:
+        print("Imported: {}".format(", ".join(imported)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
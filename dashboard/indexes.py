@@ -0,0 +1,174 @@
+"""Script: Indexes of the log collections and a check of the query plans.
+
+query_logs filters the logs on _site and timestamp, which is a collection
+scan without a compound (_site, timestamp) index. dashboard.py and
+csv2mongo.py create the indexes on startup with ensure_indexes().
+
+To check that none of the queries query_logs runs falls back to a
+collection scan (exits with status 1 if one does):
+
+python indexes.py
+    --db=dashboard [database name]
+    --host=localhost [database host name]
+    --port=27017 [database port name]
+    --site=np --[chiller plant site to query]
+    --create [optional, create the indexes first]
+    --dedup [optional, delete duplicate logs and make (_site, timestamp) unique first]
+"""
+
+import argparse
+import datetime as dt
+import sys
+
+import pymongo
+import pytz
+
+from pymongo.errors import OperationFailure
+
+import config as cfg
+import forecaster
+import log_buckets
+import rollups
+
+
+# compound indexes of the raw logs
+LOG_INDEXES = [
+    [("_site", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)]
+]
+
+# query_logs freqs
+FREQS = ("minutes", "hours", "days", "months", "years")
+
+
+def ensure_indexes(db, unique=False):
+    """Create the indexes of the logs, rollups, log buckets and forecasts.
+
+    unique=True makes (_site, timestamp) a unique key of the logs, which
+    csv2mongo.py --mode=skip/upsert relies on. A unique index is kept as
+    it is when unique is False.
+    """
+    info = db.log.index_information().values()
+    for keys in LOG_INDEXES:
+        current = [i for i in info if [k for k, _ in i["key"]] == [k for k, _ in keys]]
+        if current and (current[0].get("unique") or not unique):
+            continue
+        if current:
+            # the key pattern can only be indexed once, replace the index
+            db.log.drop_index(keys)
+        try:
+            db.log.create_index(keys, unique=unique)
+        except OperationFailure:
+            db.log.create_index(keys)
+            raise Exception("The logs have duplicate (_site, timestamp) rows, "
+                            "remove them with: python indexes.py --dedup")
+    rollups.ensure_indexes(db)
+    log_buckets.ensure_indexes(db)
+    forecaster.ensure_indexes(db)
+
+
+def query_plans(db, site, fields):
+    """Winning plan stages of the queries query_logs runs, for each freq.
+
+    Returns:
+        List of (description, list of plan stage names)
+    """
+    # dashboard imports this module (and flask), only import it when the plans are checked
+    import dashboard
+
+    end = dt.datetime.now(pytz.UTC)
+    start = end - dt.timedelta(days=1)
+    one = [{"$gt": start, "$lte": end}]
+    edges = [{"$gt": start, "$lt": start + dt.timedelta(hours=1)},
+             {"$gte": end - dt.timedelta(hours=1), "$lte": end}]
+
+    plans = []
+    for freq in FREQS:
+        for name, ranges in [("range", one), ("edges", edges)]:
+            pipeline = dashboard.logs_pipeline(site, fields, ranges, freq)
+            explain = db.command("aggregate", "log", pipeline=pipeline, explain=True)
+            plans.append(("log {} {}".format(freq, name), plan_stages(explain)))
+
+    if cfg.USE_ROLLUPS:
+        for name in rollups.COLLECTIONS.values():
+            cursor = db[name].find({"_site": site, "timestamp": {"$gte": start, "$lt": end}})
+            plans.append((name, plan_stages(cursor.explain())))
+
+    if cfg.LOG_LAYOUT == "buckets":
+        query = {"_site": site, "field": {"$in": fields}, "timestamp": {"$gte": start, "$lte": end}}
+        cursor = db[log_buckets.COLLECTION].find(query)
+        plans.append((log_buckets.COLLECTION, plan_stages(cursor.explain())))
+    return plans
+
+
+def dedup_logs(db, site=None):
+    """Delete all but the last inserted log of each (site, timestamp).
+
+    Returns:
+        Number of logs deleted
+    """
+    pipeline = [
+        {"$match": {"_site": site} if site else {}},
+        {"$group": {"_id": {"site": "$_site", "timestamp": "$timestamp"},
+                    "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    deleted = 0
+    for doc in db.log.aggregate(pipeline, allowDiskUse=True):
+        # ObjectIds grow with the insertion time
+        ids = sorted(doc["ids"])[:-1]
+        deleted += db.log.delete_many({"_id": {"$in": ids}}).deleted_count
+    return deleted
+
+
+def plan_stages(explain):
+    """Names of the stages of the winning plans in an explain output."""
+    stages = []
+    def walk(node, winning):
+        if isinstance(node, dict):
+            if winning and isinstance(node.get("stage"), str):
+                stages.append(node["stage"])
+            for key, value in node.items():
+                if key != "rejectedPlans":
+                    walk(value, winning or key == "winningPlan")
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, winning)
+    walk(explain, False)
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the query plans of query_logs")
+    parser.add_argument("--site", type=str, help="Chiller Plant site ID")
+    parser.add_argument("--db", type=str, help="MongoDB database name")
+    parser.add_argument("--host", type=str, help="MongoDB Host")
+    parser.add_argument("--port", type=int, help="MongoDB Port")
+    parser.add_argument("--create", action="store_true", help="Create the indexes first")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Delete duplicate logs and make (_site, timestamp) unique first")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(host=args.host, port=args.port, tz_aware=True)
+    db = client[args.db]
+    if args.dedup:
+        print("Deleted {} duplicate logs".format(dedup_logs(db)))
+        ensure_indexes(db, unique=True)
+    elif args.create:
+        ensure_indexes(db)
+
+    doc = db.log.find_one({"_site": args.site}) or {}
+    fields = [k for k in doc if k not in ("_id", "_site", "timestamp")][:2] or ["value"]
+
+    scans = 0
+    for name, stages in query_plans(db, args.site, fields):
+        scan = "COLLSCAN" in stages
+        scans += scan
+        print("{:<24} {:<8} {}".format(name, "COLLSCAN" if scan else "ok", " > ".join(stages)))
+    if scans:
+        print("{} queries scan a whole collection, run with --create".format(scans))
+        sys.exit(1)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Bucketed, compressed storage layout for logs.
+
+Instead of one document per minute with every sensor as a field, the
+bucket layout keeps one document per (site, field, day) holding packed
+arrays of that field:
+
+    log_buckets {"_site": "np", "field": "cwshdr", "timestamp": <day start>,
+                 "count": 1440,
+                 "times": <zlib of int32 ms offsets from the day start, delta coded>,
+                 "values": <zlib of float64 values, NaN for missing>}
+
+Reading a field then costs one small document per day and decodes straight
+into numpy. csv2mongo.py --layout=buckets writes this layout and
+dashboard.py reads it when config.LOG_LAYOUT is "buckets". Missing values
+(NaN) are skipped by the aggregates, like the rollups do.
+"""
+
+import datetime as dt
+import zlib
+
+import numpy as np
+import pymongo
+import pytz
+
+
+COLLECTION = "log_buckets"
+
+# time span of a bucket document
+UNIT = "days"
+
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+
+def ensure_indexes(db):
+    """One bucket per site, field and day."""
+    db[COLLECTION].create_index(
+        [("_site", pymongo.ASCENDING), ("field", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)],
+        unique=True)
+
+
+def encode(start, times, values):
+    """Bucket payload of times (datetime64[ms]) and values starting at start (datetime64[ms])."""
+    offsets = (times - start).astype(np.int64).astype("<i4")
+    deltas = np.diff(offsets, prepend=np.int32(0)).astype("<i4")
+    return {
+        "count": int(len(values)),
+        "times": zlib.compress(deltas.tobytes()),
+        "values": zlib.compress(np.asarray(values, dtype="<f8").tobytes())
+    }
+
+
+def decode(doc):
+    """(times as datetime64[ms], values as float64) of a bucket document."""
+    deltas = np.frombuffer(zlib.decompress(doc["times"]), dtype="<i4")
+    start = np.datetime64(to_naive(doc["timestamp"]), "ms")
+    times = start + np.cumsum(deltas, dtype=np.int64).astype("timedelta64[ms]")
+    values = np.frombuffer(zlib.decompress(doc["values"]), dtype="<f8")
+    return times, values
+
+
+def save_buckets(db, df, site, fields=None):
+    """Store the rows of df (a "timestamp" column and float fields) as buckets.
+
+    Buckets that already exist are merged with the new rows (new values
+    win on equal timestamps), so a load can be split in batches.
+    """
+    fields = fields or [c for c in df.columns if c not in ("timestamp", "_site")]
+    if df.shape[0] == 0 or not fields:
+        return 0
+
+    times = pd_to_ms(df["timestamp"])
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    days = times.astype("datetime64[D]")
+    edges = np.flatnonzero(np.diff(days.astype(np.int64))) + 1
+    bounds = list(zip(np.r_[0, edges], np.r_[edges, len(times)]))
+
+    collection = db[COLLECTION]
+    starts = [from_ms(days[a]) for a, _ in bounds]
+    existing = {}
+    query = {"_site": site, "field": {"$in": fields}, "timestamp": {"$gte": starts[0], "$lte": starts[-1]}}
+    for doc in collection.find(query):
+        existing[doc["field"], to_naive(doc["timestamp"])] = decode(doc)
+
+    ops = []
+    for f in fields:
+        values = df[f].to_numpy(dtype=np.float64)[order]
+        for (a, b), start in zip(bounds, starts):
+            t, v = times[a:b], values[a:b]
+            old = existing.get((f, start.replace(tzinfo=None)))
+            if old is not None:
+                # the first of equal timestamps is kept, so new rows go first
+                t, idx = np.unique(np.concatenate([t[::-1], old[0]]), return_index=True)
+                v = np.concatenate([v[::-1], old[1]])[idx]
+            doc = {"_site": site, "field": f, "timestamp": start}
+            doc.update(encode(days[a].astype("datetime64[ms]"), t, v))
+            ops.append(pymongo.ReplaceOne({"_site": site, "field": f, "timestamp": start}, doc, upsert=True))
+    collection.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def to_naive(t):
+    """datetime as naive UTC."""
+    return t.astimezone(pytz.UTC).replace(tzinfo=None) if t.tzinfo else t
+
+
+def from_ms(t):
+    """datetime64 as a UTC datetime."""
+    return EPOCH + dt.timedelta(milliseconds=int(t.astype("datetime64[ms]").astype(np.int64)))
+
+
+def pd_to_ms(series):
+    """timestamps of a pandas Series as naive UTC datetime64[ms]."""
+    values = series.dt.tz_convert("UTC").dt.tz_localize(None) if series.dt.tz is not None else series
+    return values.to_numpy().astype("datetime64[ms]")
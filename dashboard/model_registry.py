@@ -0,0 +1,163 @@
+"""Registry of the forecast models of ml_models/config.json."""
+import collections
+import gc
+import json
+import os
+import threading
+import time
+
+
+class ModelRegistry:
+    """Loads the models of a model directory lazily and keeps the recent ones.
+
+    config.json is parsed once and again only when it changes. A model is
+    loaded on its first use and reloaded when its file changes. The least
+    recently used models are evicted (and their TF session closed) while
+    the weights of the loaded models take more than `budget` bytes.
+
+    Args:
+        model_dir   := directory of config.json and the model files
+        loader      := function(model path) returning a keras model
+        budget      := bytes of model weights kept in memory
+    """
+
+    def __init__(self, model_dir, loader, budget=512 * 2 ** 20):
+        self.model_dir = model_dir
+        self.loader = loader
+        self.budget = budget
+        self.models = collections.OrderedDict()
+        self.counters = {}
+        self.evictions = 0
+        self.lock = threading.RLock()
+        self._config = None
+        self._config_mtime = None
+
+    def configs(self):
+        """Model configurations of config.json."""
+        path = os.path.join(self.model_dir, "config.json")
+        with self.lock:
+            mtime = os.path.getmtime(path)
+            if mtime != self._config_mtime:
+                with open(path) as f:
+                    self._config = json.load(f)
+                self._config_mtime = mtime
+            return self._config
+
+    def config(self, target):
+        """Configuration of the model forecasting target, None if there is none.
+
+        The last one of config.json wins if several forecast the target.
+        """
+        for c in reversed(self.configs()):
+            if c["target"].lower() == target.lower():
+                return c
+        return None
+
+    def get(self, name):
+        """The model of file `name`, loaded if needed."""
+        path = os.path.join(self.model_dir, name)
+        with self.lock:
+            mtime = os.path.getmtime(path)
+            model = self.models.get(name)
+            if model is not None and model.mtime != mtime:
+                self._release(name)
+                model = None
+            if model is None:
+                model = self._load(name, path, mtime)
+            self.models.move_to_end(name)
+
+            # evict the least recently used models beyond the budget
+            while self.memory() > self.budget and len(self.models) > 1:
+                self._release(next(iter(self.models)))
+                self.evictions += 1
+            return model
+
+    def memory(self):
+        """Bytes of weights of the loaded models."""
+        return sum(m.memory for m in self.models.values())
+
+    def clear(self):
+        with self.lock:
+            for name in list(self.models):
+                self._release(name)
+
+    def stats(self):
+        with self.lock:
+            models = {}
+            for name, counters in self.counters.items():
+                models[name] = dict(counters, loaded=name in self.models)
+                if name in self.models:
+                    models[name]["calls"] += self.models[name].calls
+                    models[name]["rows"] += self.models[name].rows
+            return {
+                "models": models,
+                "memory": self.memory(),
+                "budget": self.budget,
+                "evictions": self.evictions
+            }
+
+    def _load(self, name, path, mtime):
+        start = time.time()
+        # NumPy models (numpy_lstm.py) run without TensorFlow
+        graph, session = (None, None) if path.endswith(".npz") else _new_session()
+        if session is None:
+            model = self.loader(path)
+        else:
+            with graph.as_default(), session.as_default():
+                model = self.loader(path)
+        model = _LoadedModel(model, mtime, graph, session)
+
+        counters = self.counters.setdefault(
+            name, {"loads": 0, "load_seconds": 0.0, "memory": 0, "calls": 0, "rows": 0})
+        counters["loads"] += 1
+        counters["load_seconds"] = time.time() - start
+        counters["memory"] = model.memory
+        self.models[name] = model
+        return model
+
+    def _release(self, name):
+        model = self.models.pop(name)
+        counters = self.counters[name]
+        counters["calls"] += model.calls
+        counters["rows"] += model.rows
+        model.close()
+        gc.collect()
+
+
+class _LoadedModel:
+    """A keras model with the TF graph and session it was loaded in."""
+
+    def __init__(self, model, mtime, graph=None, session=None):
+        self.model = model
+        self.mtime = mtime
+        self.graph = graph
+        self.session = session
+        self.memory = sum(w.nbytes for w in model.get_weights())
+        self.calls = 0
+        self.rows = 0
+
+    def predict(self, x, batch_size=32):
+        self.calls += 1
+        self.rows += x.shape[0]
+        if self.session is None:
+            return self.model.predict(x, batch_size=batch_size)
+        with self.graph.as_default(), self.session.as_default():
+            return self.model.predict(x, batch_size=batch_size)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+        self.model = self.graph = self.session = None
+
+
+def _new_session():
+    """A graph and session of its own for a model on TensorFlow 1.x, (None, None) otherwise.
+
+    A closed session frees the memory of its model only. TensorFlow 2 frees
+    a model once it is not referenced anymore.
+    """
+    import tensorflow as tf
+    if not hasattr(tf, "Session"):
+        return None, None
+    graph = tf.Graph()
+    return graph, tf.Session(graph=graph)
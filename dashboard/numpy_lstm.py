@@ -0,0 +1,159 @@
+"""Script: Export keras LSTM forecast models to NumPy.
+
+The LSTM and Dense weights of a model (model.get_weights()) are saved in a
+.npz file, and NumpyModel runs the same forward pass with NumPy only, so
+forecasts are served without importing TensorFlow. Recurrent layers run
+stateless, like forecaster.batch_model.
+
+python numpy_lstm.py
+    --model=ml_models/cwshdr2.h5 [keras model file]
+    --out=ml_models/cwshdr2.npz [optional, default next to the model]
+
+The export checks that both give the same predictions on random inputs.
+Then use the .npz file as "model_name" in ml_models/config.json.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "tanh": np.tanh,
+    "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+    "relu": lambda x: np.maximum(x, 0.0),
+    # keras 2 definition, keras 3 changed it (see export)
+    "hard_sigmoid": lambda x: np.clip(0.2 * x + 0.5, 0.0, 1.0),
+    "hard_sigmoid_v3": lambda x: np.clip(x / 6.0 + 0.5, 0.0, 1.0),
+}
+
+
+class NumpyModel:
+    """Stack of LSTM and Dense layers with a keras like predict()."""
+
+    def __init__(self, layers, weights):
+        self.layers = layers
+        self.weights = weights
+
+    def get_weights(self):
+        return self.weights
+
+    def predict(self, x, batch_size=None):
+        """Outputs of x (batch, timesteps, features), batch_size rows at a time."""
+        x = np.asarray(x, dtype=np.float32)
+        batch_size = batch_size or x.shape[0] or 1
+        outputs = [self._forward(x[i:i + batch_size]) for i in range(0, x.shape[0], batch_size)]
+        return np.concatenate(outputs) if outputs else self._forward(x)
+
+    def _forward(self, x):
+        weights = iter(self.weights)
+        for layer in self.layers:
+            arrays = [next(weights) for _ in range(layer["weights"])]
+            if layer["kind"] == "LSTM":
+                x = _lstm(x, layer, *arrays)
+            else:
+                x = _dense(x, layer, *arrays)
+        return x
+
+
+def _dense(x, layer, kernel, bias=None):
+    y = x @ kernel
+    if bias is not None:
+        y += bias
+    return ACTIVATIONS[layer["activation"]](y)
+
+
+def _lstm(x, layer, kernel, recurrent_kernel, bias=None):
+    units = layer["units"]
+    act = ACTIVATIONS[layer["activation"]]
+    rec_act = ACTIVATIONS[layer["recurrent_activation"]]
+
+    # input projections of all the timesteps at once, gates are i, f, c, o
+    z_x = x @ kernel
+    if bias is not None:
+        z_x += bias
+    h = np.zeros((x.shape[0], units), dtype=x.dtype)
+    c = np.zeros((x.shape[0], units), dtype=x.dtype)
+    steps = range(x.shape[1])
+    if layer["go_backwards"]:
+        steps = reversed(steps)
+
+    outputs = []
+    for t in steps:
+        z = z_x[:, t] + h @ recurrent_kernel
+        i = rec_act(z[:, :units])
+        f = rec_act(z[:, units:2 * units])
+        o = rec_act(z[:, 3 * units:])
+        c = f * c + i * act(z[:, 2 * units:3 * units])
+        h = o * act(c)
+        outputs.append(h)
+    if layer["return_sequences"]:
+        return np.stack(outputs, axis=1)
+    return h
+
+
+def export(model, path):
+    """Save the layers and weights of a keras model as a .npz file."""
+    import keras
+
+    layers, weights = [], []
+    for layer in model.layers:
+        kind = layer.__class__.__name__
+        config = layer.get_config()
+        arrays = layer.get_weights()
+        # no weights, and dropout does nothing at inference time
+        if kind in ("InputLayer", "Dropout"):
+            continue
+        if kind not in ("LSTM", "Dense"):
+            raise ValueError("{} layers can not be exported".format(kind))
+        spec = {"kind": kind, "weights": len(arrays), "activation": config["activation"]}
+        if kind == "LSTM":
+            spec.update(units=config["units"], recurrent_activation=config["recurrent_activation"],
+                        return_sequences=config["return_sequences"],
+                        go_backwards=config.get("go_backwards", False))
+            if spec["recurrent_activation"] == "hard_sigmoid" and int(keras.__version__.split(".")[0]) >= 3:
+                spec["recurrent_activation"] = "hard_sigmoid_v3"
+        for name in ("activation", "recurrent_activation"):
+            if name in spec and spec[name] not in ACTIVATIONS:
+                raise ValueError("{} activation is not supported".format(spec[name]))
+        layers.append(spec)
+        weights.extend(np.asarray(a, dtype=np.float32) for a in arrays)
+
+    arrays = dict(("w{}".format(i), w) for i, w in enumerate(weights))
+    np.savez_compressed(path, layers=np.array(json.dumps(layers)), **arrays)
+
+
+def load(path):
+    """NumpyModel of a .npz file written by export."""
+    with np.load(path) as data:
+        layers = json.loads(str(data["layers"]))
+        weights = [data["w{}".format(i)] for i in range(sum(l["weights"] for l in layers))]
+    return NumpyModel(layers, weights)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a keras LSTM model to NumPy")
+    parser.add_argument("--model", type=str, help="Keras model file")
+    parser.add_argument("--out", type=str, help="Output .npz file, default next to the model")
+    parser.add_argument("--batch", type=int, default=256, help="Random inputs to check the export on")
+    args = parser.parse_args()
+
+    import forecaster
+    model = forecaster.batch_model(args.model)
+    out = args.out or os.path.splitext(args.model)[0] + ".npz"
+    export(model, out)
+
+    # both models should forecast the same
+    shape = (args.batch,) + tuple(model.input_shape[1:])
+    x = np.random.RandomState(0).uniform(0, 1, shape).astype(np.float32)
+    diff = np.abs(model.predict(x, batch_size=args.batch) - load(out).predict(x)).max()
+    print("Saved {} ({} bytes), max difference {:.2e}".format(out, os.path.getsize(out), diff))
+    if diff > 1e-4:
+        raise Exception("The NumPy model does not match the keras model!")
+
+
+if __name__ == "__main__":
+    main()
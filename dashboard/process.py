@@ -1,6 +1,7 @@
 # Data preprocessing module. 
 # Note: Check IPython Notebooks for results on using these..
 
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.preprocessing import MinMaxScaler
 
 import numpy as np
@@ -33,6 +34,61 @@ def smooth_data(df, cols=[]):
     return df
 
 
+# the steps preprocess_pipeline knows, in their usual order
+PIPELINE_STEPS = ("replace_nulls", "replace_with_near", "smooth_data")
+
+
+# replace_nulls, replace_with_near and smooth_data fused into one pass over
+# a single float array: df[cols] is copied out once, the steps run in place
+# on it and the result is written back once. the forward fills of
+# consecutive steps are merged, rolling means are pandas' (same numbers).
+# cols come back as float64, like the chain leaves float64 frames.
+def preprocess_pipeline(df, steps=PIPELINE_STEPS, cols=[], thresh=0.1):
+    unknown = [s for s in steps if s not in PIPELINE_STEPS]
+    if unknown:
+        raise ValueError("unknown preprocessing steps: {}".format(unknown))
+
+    cols = list(cols or df.columns)
+    data = df[cols].to_numpy(dtype=np.float64, copy=True)
+    near = np.array([not c.endswith("_bin") for c in cols], dtype=bool)
+    pad = np.zeros(len(cols), dtype=bool) # columns waiting for a forward fill
+
+    for step in steps:
+        if step == "replace_nulls":
+            _pad(data, pad)
+            np.copyto(data, _rolling_mean(data, 5), where=np.isnan(data))
+            pad[:] = True
+        elif step == "replace_with_near":
+            # masking commutes with a pending forward fill, one fill does both
+            with np.errstate(invalid="ignore"):
+                mask = data < thresh
+            mask[:, ~near] = False
+            data[mask] = np.nan
+            pad |= near
+        elif step == "smooth_data":
+            _pad(data, pad)
+            pad[:] = False
+            data = _rolling_mean(data, 10)
+    _pad(data, pad)
+
+    df[cols] = data
+    return df
+
+
+def _rolling_mean(data, window):
+    return pd.DataFrame(data).rolling(window, min_periods=1).mean().to_numpy()
+
+
+# forward fill the columns of data selected by the boolean mask `which`
+def _pad(data, which):
+    if not which.any():
+        return
+    sub = data[:, which]
+    idx = np.where(np.isnan(sub), 0, np.arange(sub.shape[0])[:, np.newaxis])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    data[:, which] = np.take_along_axis(sub, idx, axis=0)
+
+
 # normalize dataframe
 def get_normalized_df(df, scale=(0.1,1), cols=[]):
     # columns and index
@@ -50,20 +106,38 @@ def get_normalized_df(df, scale=(0.1,1), cols=[]):
 
 
 # prepare feature vectors for keras
-def prepare_features(dataframe, features, target, N=1):
-    x, y = [], []
+# x[i] holds the N rows before y[i]. x is a read-only view on the feature
+# data (no copy per window). step keeps every step-th window only.
+def prepare_features(dataframe, features, target, N=1, step=1):
     features_data = dataframe[features].values
     target_data = dataframe[target].values
-    
-    for i in range(dataframe.shape[0]-N):
-        x.append(features_data[i:i+N])
-        y.append(target_data[i+N])
-    
-    x = np.array(x)
-    y = np.array(y)
+    count = dataframe.shape[0] - N
+    return sliding_windows(features_data, target_data, N, count, step)
+
+
+# first `count` windows of N rows of features_data and the target row
+# following each window
+def sliding_windows(features_data, target_data, N, count, step=1):
+    if count <= 0:
+        return np.array([]), np.array([])
+    x = sliding_window_view(features_data, N, axis=0)[:count:step]
+    if x.ndim == 3:
+        x = x.swapaxes(1, 2)
+    # y is a fresh array, like the old loops returned
+    y = target_data[N:N + count:step].copy()
     return x, y
 
 
+# iterate over keras shaped (x, y) batches, copying one batch at a time.
+# loop=True repeats forever as keras' fit_generator expects.
+def feature_batches(x, y, batch_size, loop=False):
+    while True:
+        for i in range(0, x.shape[0], batch_size):
+            yield Reshape.x(x[i:i + batch_size]), Reshape.y(y[i:i + batch_size])
+        if not loop:
+            return
+
+
 class Reshape:
     """Keras shape requirements."""
 
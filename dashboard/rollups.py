@@ -0,0 +1,257 @@
+"""Script: Pre-aggregated rollups of the log collection.
+
+For every site and hour/day/month/year, a rollup collection keeps the
+sum, count, min and max of each field. avg, sum, min and max over any
+range of whole buckets are derived from these without touching the raw
+minute logs. Missing values (NaN, null) are skipped.
+
+    rollup_hours    {"_site": "np", "timestamp": <bucket start>,
+                     "cwshdr": {"sum": .., "count": .., "min": .., "max": ..}, ...}
+
+csv2mongo.py updates the rollups of the rows it loads. To (re)build the
+rollups of logs that are already in the database:
+
+python rollups.py
+    --db=dashboard [database name]
+    --host=localhost [database host name]
+    --port=27017 [database port name]
+    --site=np --[chiller plant site to backfill]
+"""
+
+import argparse
+import pymongo
+
+from bucket_cache import floor_time, next_time, trunc_expr
+
+
+# rollup units, coarse to fine, and their collections
+UNITS = ("years", "months", "days", "hours")
+COLLECTIONS = dict((u, "rollup_" + u) for u in UNITS)
+
+# pandas resample rule of each unit
+RULES = {"years": "AS", "months": "MS", "days": "D", "hours": "H"}
+
+
+def ensure_indexes(db):
+    """One rollup document per site and bucket."""
+    for name in COLLECTIONS.values():
+        db[name].create_index([("_site", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)], unique=True)
+
+
+def update_rollups(db, df, site, fields=None):
+    """Add the rows of df (a "timestamp" column and float fields) to the rollups.
+
+    Buckets are upserted: $inc adds to sum and count, $min/$max widen the
+    range, so rows can be loaded in any number of batches.
+    """
+    fields = fields or [c for c in df.columns if c not in ("timestamp", "_site")]
+    if df.shape[0] == 0 or not fields:
+        return
+    data = df.set_index("timestamp")[fields]
+    for unit in UNITS:
+        stats = data.resample(RULES[unit]).agg(["sum", "count", "min", "max"])
+        rows = data.resample(RULES[unit]).size()
+        stats = stats[rows.values > 0]
+
+        ops = []
+        for t, row in zip(stats.index, stats.itertuples(index=False)):
+            update = {"$inc": {}, "$min": {}, "$max": {}}
+            for i, f in enumerate(fields):
+                total, count, low, high = row[4 * i:4 * i + 4]
+                update["$inc"][f + ".sum"] = float(total)
+                update["$inc"][f + ".count"] = int(count)
+                if count > 0:
+                    update["$min"][f + ".min"] = float(low)
+                    update["$max"][f + ".max"] = float(high)
+            update = dict((k, v) for k, v in update.items() if v)
+            key = {"_site": site, "timestamp": t.to_pydatetime()}
+            ops.append(pymongo.UpdateOne(key, update, upsert=True))
+        db[COLLECTIONS[unit]].bulk_write(ops, ordered=False)
+
+
+def backfill(db, site, fields=None, start=None, end=None):
+    """Rebuild the rollups of a site from its raw logs.
+
+    With start and end (datetimes), only the years from start to end are
+    rebuilt.
+    """
+    fields = fields or _log_fields(db, site)
+    match = {"_site": site}
+    if start is not None:
+        match["timestamp"] = {"$gte": floor_time(start, "years"), "$lt": next_time(end, "years")}
+
+    # hourly stats from the logs, coarser ones from the hourly ones
+    pipeline = [
+        {"$match": match},
+        {"$group": _stats_group(trunc_expr("hours"), fields)}
+    ]
+    hours = {}
+    for doc in db.log.aggregate(pipeline, allowDiskUse=True):
+        hours[doc["_id"]] = dict((f, _doc_stats(doc, f)) for f in fields)
+
+    for unit in UNITS:
+        buckets = {}
+        for t, stats in hours.items():
+            bucket = buckets.setdefault(floor_time(t, unit), {})
+            for f, s in stats.items():
+                _merge(bucket.setdefault(f, [0.0, 0, None, None]), s)
+
+        docs = []
+        for t in sorted(buckets):
+            doc = {"_site": site, "timestamp": t}
+            for f, (total, count, low, high) in buckets[t].items():
+                doc[f] = {"sum": total, "count": count}
+                if count > 0:
+                    doc[f].update(min=low, max=high)
+            docs.append(doc)
+
+        collection = db[COLLECTIONS[unit]]
+        collection.delete_many(match)
+        if docs:
+            collection.insert_many(docs, ordered=False)
+        print("{}: {} buckets".format(COLLECTIONS[unit], len(docs)))
+
+
+def covers(db, site):
+    """True if the rollups hold the first and the last logged hour of a site.
+
+    False until rollups.py backfilled the logs that were loaded before the
+    rollups existed (csv2mongo.py only rolls up the rows it loads).
+    """
+    for direction in (pymongo.ASCENDING, pymongo.DESCENDING):
+        log = db.log.find_one({"_site": site}, {"timestamp": 1}, sort=[("timestamp", direction)])
+        if log is None:
+            return True
+        hour = floor_time(log["timestamp"], "hours")
+        if db[COLLECTIONS["hours"]].find_one({"_site": site, "timestamp": hour}, {"_id": 1}) is None:
+            return False
+    return True
+
+
+def aggregate(db, site, fields, ranges, freq, func, order):
+    """query_logs aggregation computed from the rollups.
+
+    Every range is split in whole buckets of the coarsest rollup units that
+    fit (no coarser than freq) and what is left at both ends, which is
+    aggregated from the raw logs and is at most two hours long.
+
+    Args:
+        ranges      := List of timestamp conditions (eg: {"$gt": start, "$lte": end})
+        others      := see dashboard.query_logs
+    Returns:
+        List of documents, {"_id": bucket, field: value, ...}
+    """
+    units = UNITS[UNITS.index(freq):]
+    pieces, raw = [], []
+    for r in ranges:
+        lower = ("$gte", r["$gte"]) if "$gte" in r else ("$gt", r["$gt"])
+        upper = ("$lte", r["$lte"]) if "$lte" in r else ("$lt", r["$lt"])
+        for unit, cond in _split(lower, upper, units):
+            (raw if unit is None else pieces).append((unit, cond))
+
+    # sum, count, min, max per output bucket and field
+    buckets = {}
+    def add(t, stats):
+        bucket = buckets.setdefault(floor_time(t, freq), {})
+        for f, s in stats.items():
+            _merge(bucket.setdefault(f, [0.0, 0, None, None]), s)
+
+    for unit, cond in pieces:
+        query = {"_site": site, "timestamp": cond}
+        projection = dict([("timestamp", 1)] + [(f, 1) for f in fields])
+        for doc in db[COLLECTIONS[unit]].find(query, projection):
+            add(doc["timestamp"], dict((f, _rollup_stats(doc.get(f))) for f in fields))
+
+    if raw:
+        match = {"_site": site, "$or": [{"timestamp": cond} for _, cond in raw]}
+        pipeline = [{"$match": match}, {"$group": _stats_group(trunc_expr(freq), fields)}]
+        for doc in db.log.aggregate(pipeline):
+            add(doc["_id"], dict((f, _doc_stats(doc, f)) for f in fields))
+
+    results = []
+    for t in sorted(buckets, reverse=order == -1):
+        doc = {"_id": t}
+        for f in fields:
+            total, count, low, high = buckets[t].get(f, (0.0, 0, None, None))
+            doc[f] = {
+                "avg": total / count if count else None,
+                "sum": total,
+                "min": low,
+                "max": high
+            }[func]
+        results.append(doc)
+    return results
+
+
+def _split(lower, upper, units):
+    """[(unit, timestamp condition)] covering lower..upper, unit None for raw logs."""
+    if lower[1] >= upper[1]:
+        return [(None, dict([lower, upper]))] if lower[0] == "$gte" and upper[0] == "$lte" else []
+    if not units:
+        return [(None, dict([lower, upper]))]
+
+    # whole buckets of this unit are [a, b)
+    unit = units[0]
+    a = lower[1] if lower[0] == "$gte" and floor_time(lower[1], unit) == lower[1] \
+        else next_time(lower[1], unit)
+    b = floor_time(upper[1], unit)
+    if a >= b:
+        return _split(lower, upper, units[1:])
+    return _split(lower, ("$lt", a), units[1:]) + [(unit, {"$gte": a, "$lt": b})] + \
+        _split(("$gte", b), upper, units[1:])
+
+
+def _stats_group(group_id, fields):
+    """$group computing sum/count/min/max of fields, skipping NaN and null."""
+    group = {"_id": group_id}
+    for f in fields:
+        # NaN and null sort before all numbers
+        ok = {"$gt": ["$" + f, float("-inf")]}
+        group[f + "__sum"] = {"$sum": {"$cond": [ok, "$" + f, 0]}}
+        group[f + "__count"] = {"$sum": {"$cond": [ok, 1, 0]}}
+        group[f + "__min"] = {"$min": {"$cond": [ok, "$" + f, None]}}
+        group[f + "__max"] = {"$max": {"$cond": [ok, "$" + f, None]}}
+    return group
+
+
+def _doc_stats(doc, f):
+    return (doc[f + "__sum"], doc[f + "__count"], doc[f + "__min"], doc[f + "__max"])
+
+
+def _rollup_stats(stats):
+    if not stats:
+        return (0.0, 0, None, None)
+    return (stats["sum"], stats["count"], stats.get("min"), stats.get("max"))
+
+
+def _merge(acc, stats):
+    total, count, low, high = stats
+    acc[0] += total
+    acc[1] += count
+    if count:
+        acc[2] = low if acc[2] is None else min(acc[2], low)
+        acc[3] = high if acc[3] is None else max(acc[3], high)
+
+
+def _log_fields(db, site):
+    doc = db.log.find_one({"_site": site}) or {}
+    return [k for k in doc if k not in ("_id", "_site", "timestamp")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the rollups of a site from its logs")
+    parser.add_argument("--site", type=str, help="Chiller Plant site ID")
+    parser.add_argument("--db", type=str, help="MongoDB database name")
+    parser.add_argument("--host", type=str, help="MongoDB Host")
+    parser.add_argument("--port", type=int, help="MongoDB Port")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(host=args.host, port=args.port, tz_aware=True)
+    db = client[args.db]
+    ensure_indexes(db)
+    backfill(db, args.site)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-try:
-    from ._fastdtw import fastdtw, dtw
-except ImportError:
-    from .fastdtw import fastdtw, dtw
+from .fastdtw import fastdtw, dtw, backend
+from .pairwise import pdist, cdist
+from .search import knn, lb_envelopes
+from .streaming import StreamingSubsequenceDTW
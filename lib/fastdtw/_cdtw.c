@@ -0,0 +1,658 @@
+/*
+ * Compiled kernels for fastdtw.
+ *
+ * Only the Python C API and the buffer protocol are used, so the module
+ * builds with a plain C compiler and does not need numpy headers. The
+ * Python side (fastdtw.py) allocates the arrays, checks dtypes and falls
+ * back to the pure Python engine when this module is not available.
+ *
+ * All arithmetic mirrors the pure Python engine (same order of float
+ * operations, same tie-breaking) so both engines return identical
+ * distances and paths.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <math.h>
+#include <stdlib.h>
+
+/* steps stored in the direction matrix, same values as fastdtw.py */
+#define STEP_UP 0
+#define STEP_LEFT 1
+#define STEP_DIAG 2
+
+/* metrics understood by dtw(), see fastdtw.__c_metric */
+#define METRIC_L1 0
+#define METRIC_LINF 1
+
+/* same as numpy's pairwise summation, so the 1-norm of a feature vector
+ * matches np.linalg.norm(..., 1, axis=-1) bit for bit. */
+#define PW_BLOCKSIZE 128
+
+static double
+pairwise_sum(const double *a, Py_ssize_t n)
+{
+    Py_ssize_t i;
+    if (n < 8) {
+        double res = 0.;
+        for (i = 0; i < n; i++) {
+            res += a[i];
+        }
+        return res;
+    }
+    else if (n <= PW_BLOCKSIZE) {
+        double r[8], res;
+        for (i = 0; i < 8; i++) {
+            r[i] = a[i];
+        }
+        for (i = 8; i < n - (n % 8); i += 8) {
+            r[0] += a[i + 0];
+            r[1] += a[i + 1];
+            r[2] += a[i + 2];
+            r[3] += a[i + 3];
+            r[4] += a[i + 4];
+            r[5] += a[i + 5];
+            r[6] += a[i + 6];
+            r[7] += a[i + 7];
+        }
+        res = ((r[0] + r[1]) + (r[2] + r[3])) +
+              ((r[4] + r[5]) + (r[6] + r[7]));
+        for (; i < n; i++) {
+            res += a[i];
+        }
+        return res;
+    }
+    else {
+        Py_ssize_t n2 = n / 2;
+        n2 -= n2 % 8;
+        return pairwise_sum(a, n2) + pairwise_sum(a + n2, n - n2);
+    }
+}
+
+static double
+distance(const double *a, const double *b, Py_ssize_t dim, int metric,
+         double *scratch)
+{
+    Py_ssize_t k;
+    double res;
+    if (dim == 1) {
+        return fabs(*a - *b);
+    }
+    if (metric == METRIC_LINF) {
+        res = fabs(a[0] - b[0]);
+        for (k = 1; k < dim; k++) {
+            double d = fabs(a[k] - b[k]);
+            if (d > res) {
+                res = d;
+            }
+        }
+        return res;
+    }
+    for (k = 0; k < dim; k++) {
+        scratch[k] = fabs(a[k] - b[k]);
+    }
+    return pairwise_sum(scratch, dim);
+}
+
+/* costs (and steps, if not NULL) of row i covering the columns
+ * lo_i..hi_i-1 from the costs of the previous row, which covers
+ * prev_lo..prev_hi-1. the row before the first one only holds the
+ * origin, pass prev = NULL for it. */
+static void
+fill_row(const double *xi, const double *y, Py_ssize_t dim, int metric,
+         double *scratch, Py_ssize_t lo_i, Py_ssize_t hi_i,
+         const double *prev, Py_ssize_t prev_lo, Py_ssize_t prev_hi,
+         double *row, signed char *row_steps)
+{
+    Py_ssize_t j;
+    double left = INFINITY;
+
+    for (j = lo_i; j < hi_i; j++) {
+        double d = distance(xi, y + j * dim, dim, metric, scratch);
+        double u, l, g;
+        signed char step;
+
+        if (prev == NULL) {
+            u = INFINITY;
+            g = j == 0 ? 0. : INFINITY;
+        }
+        else {
+            u = (j >= prev_lo && j < prev_hi) ? prev[j - prev_lo] : INFINITY;
+            g = (j - 1 >= prev_lo && j - 1 < prev_hi) ?
+                prev[j - 1 - prev_lo] : INFINITY;
+        }
+        u += d;
+        l = left + d;
+        g += d;
+
+        /* ties go to up, then left, then diagonal */
+        if (u <= l && u <= g) {
+            left = u;
+            step = STEP_UP;
+        }
+        else if (l <= g) {
+            left = l;
+            step = STEP_LEFT;
+        }
+        else {
+            left = g;
+            step = STEP_DIAG;
+        }
+        row[j - lo_i] = left;
+        if (row_steps != NULL) {
+            row_steps[j - lo_i] = step;
+        }
+    }
+}
+
+/* rows must be non empty, in bounds, start at non decreasing columns and
+ * the window must hold both corners. */
+static int
+check_window(const Py_ssize_t *lo, const Py_ssize_t *hi, Py_ssize_t len_x,
+             Py_ssize_t len_y)
+{
+    Py_ssize_t i;
+    for (i = 0; i < len_x; i++) {
+        if (lo[i] < 0 || hi[i] > len_y || lo[i] >= hi[i] ||
+                (i > 0 && lo[i] < lo[i - 1])) {
+            PyErr_Format(PyExc_ValueError, "invalid window at row %zd", i);
+            return -1;
+        }
+    }
+    if (lo[0] != 0 || hi[len_x - 1] != len_y) {
+        PyErr_SetString(PyExc_ValueError, "window must contain both corners");
+        return -1;
+    }
+    return 0;
+}
+
+static int
+get_buffer(PyObject *obj, Py_buffer *view, Py_ssize_t itemsize,
+           int writable, const char *name)
+{
+    int flags = PyBUF_C_CONTIGUOUS | (writable ? PyBUF_WRITABLE : 0);
+    if (PyObject_GetBuffer(obj, view, flags) < 0) {
+        return -1;
+    }
+    if (view->itemsize != itemsize) {
+        PyErr_Format(PyExc_TypeError, "%s has an itemsize of %zd, "
+                     "expected %zd", name, view->itemsize, itemsize);
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+PyDoc_STRVAR(dtw_doc,
+"dtw(x, y, lo, hi, dim, metric) -> (distance, path)\n\n"
+"DTW restricted to the window where row i covers the columns\n"
+"lo[i]..hi[i]-1. x and y are float64 buffers of len * dim items,\n"
+"lo and hi are intp buffers of len(x) items.");
+
+static PyObject *
+cdtw_dtw(PyObject *self, PyObject *args)
+{
+    PyObject *x_obj, *y_obj, *lo_obj, *hi_obj;
+    PyObject *path = NULL, *result = NULL;
+    Py_buffer xb, yb, lob, hib;
+    Py_ssize_t dim, len_x, len_y, total, i, j, n, k;
+    Py_ssize_t *offsets = NULL;
+    double *D = NULL, *scratch = NULL;
+    signed char *steps = NULL;
+    int metric, ok = 0;
+
+    if (!PyArg_ParseTuple(args, "OOOOni", &x_obj, &y_obj, &lo_obj, &hi_obj,
+                          &dim, &metric)) {
+        return NULL;
+    }
+    if (dim < 1) {
+        PyErr_SetString(PyExc_ValueError, "dim must be positive");
+        return NULL;
+    }
+    if (get_buffer(x_obj, &xb, sizeof(double), 0, "x") < 0) {
+        return NULL;
+    }
+    if (get_buffer(y_obj, &yb, sizeof(double), 0, "y") < 0) {
+        PyBuffer_Release(&xb);
+        return NULL;
+    }
+    if (get_buffer(lo_obj, &lob, sizeof(Py_ssize_t), 0, "lo") < 0) {
+        PyBuffer_Release(&xb);
+        PyBuffer_Release(&yb);
+        return NULL;
+    }
+    if (get_buffer(hi_obj, &hib, sizeof(Py_ssize_t), 0, "hi") < 0) {
+        PyBuffer_Release(&xb);
+        PyBuffer_Release(&yb);
+        PyBuffer_Release(&lob);
+        return NULL;
+    }
+
+    {
+        const double *x = (const double *)xb.buf;
+        const double *y = (const double *)yb.buf;
+        const Py_ssize_t *lo = (const Py_ssize_t *)lob.buf;
+        const Py_ssize_t *hi = (const Py_ssize_t *)hib.buf;
+
+        len_x = xb.len / (Py_ssize_t)sizeof(double) / dim;
+        len_y = yb.len / (Py_ssize_t)sizeof(double) / dim;
+        if (len_x == 0 || len_y == 0 ||
+                lob.len / (Py_ssize_t)sizeof(Py_ssize_t) != len_x ||
+                hib.len / (Py_ssize_t)sizeof(Py_ssize_t) != len_x) {
+            PyErr_SetString(PyExc_ValueError, "window does not match x");
+            goto done;
+        }
+
+        if (check_window(lo, hi, len_x, len_y) < 0) {
+            goto done;
+        }
+        offsets = (Py_ssize_t *)malloc((len_x + 1) * sizeof(Py_ssize_t));
+        if (offsets == NULL) {
+            PyErr_NoMemory();
+            goto done;
+        }
+        offsets[0] = 0;
+        for (i = 0; i < len_x; i++) {
+            offsets[i + 1] = offsets[i] + hi[i] - lo[i];
+        }
+        total = offsets[len_x];
+
+        D = (double *)malloc(total * sizeof(double));
+        steps = (signed char *)malloc(total);
+        scratch = (double *)malloc(dim * sizeof(double));
+        if (D == NULL || steps == NULL || scratch == NULL) {
+            PyErr_NoMemory();
+            goto done;
+        }
+
+        Py_BEGIN_ALLOW_THREADS
+        for (i = 0; i < len_x; i++) {
+            fill_row(x + i * dim, y, dim, metric, scratch, lo[i], hi[i],
+                     i ? D + offsets[i - 1] : NULL,
+                     i ? lo[i - 1] : -1, i ? hi[i - 1] : 0,
+                     D + offsets[i], steps + offsets[i]);
+        }
+        Py_END_ALLOW_THREADS
+
+        /* walk back once to size the path, then fill it in order */
+        n = 0;
+        i = len_x - 1;
+        j = len_y - 1;
+        for (;;) {
+            signed char step = steps[offsets[i] + j - lo[i]];
+            n++;
+            if (step == STEP_UP) {
+                i--;
+            }
+            else if (step == STEP_LEFT) {
+                j--;
+            }
+            else if (i == 0 && j == 0) {
+                break;
+            }
+            else {
+                i--;
+                j--;
+            }
+            if (i < 0 || j < 0 || j < lo[i] || j >= hi[i]) {
+                PyErr_SetString(PyExc_ValueError,
+                                "path leaves the window");
+                goto done;
+            }
+        }
+
+        path = PyList_New(n);
+        if (path == NULL) {
+            goto done;
+        }
+        i = len_x - 1;
+        j = len_y - 1;
+        for (k = n - 1; k >= 0; k--) {
+            signed char step = steps[offsets[i] + j - lo[i]];
+            PyObject *cell = Py_BuildValue("(nn)", i, j);
+            if (cell == NULL) {
+                goto done;
+            }
+            PyList_SET_ITEM(path, k, cell);
+            if (step == STEP_UP) {
+                i--;
+            }
+            else if (step == STEP_LEFT) {
+                j--;
+            }
+            else {
+                i--;
+                j--;
+            }
+        }
+
+        result = Py_BuildValue("(dO)", D[total - 1], path);
+        ok = result != NULL;
+    }
+
+done:
+    Py_XDECREF(path);
+    free(offsets);
+    free(D);
+    free(steps);
+    free(scratch);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&yb);
+    PyBuffer_Release(&lob);
+    PyBuffer_Release(&hib);
+    return ok ? result : NULL;
+}
+
+PyDoc_STRVAR(dtw_distance_doc,
+"dtw_distance(x, y, lo, hi, dim, metric) -> distance\n\n"
+"Same as dtw() without the path, keeping only two rows of costs. lo and\n"
+"hi may be None for the full window, in which case the rows run along\n"
+"the longer series so a row holds min(len(x), len(y)) costs.");
+
+static PyObject *
+cdtw_dtw_distance(PyObject *self, PyObject *args)
+{
+    PyObject *x_obj, *y_obj, *lo_obj, *hi_obj, *result = NULL;
+    Py_buffer xb, yb, lob, hib;
+    Py_ssize_t dim, len_x, len_y, width, i;
+    const Py_ssize_t *lo = NULL, *hi = NULL;
+    const double *x, *y;
+    double *prev = NULL, *cur = NULL, *scratch = NULL;
+    int metric, full;
+
+    if (!PyArg_ParseTuple(args, "OOOOni", &x_obj, &y_obj, &lo_obj, &hi_obj,
+                          &dim, &metric)) {
+        return NULL;
+    }
+    if (dim < 1) {
+        PyErr_SetString(PyExc_ValueError, "dim must be positive");
+        return NULL;
+    }
+    full = lo_obj == Py_None || hi_obj == Py_None;
+    lob.obj = hib.obj = NULL;
+    if (get_buffer(x_obj, &xb, sizeof(double), 0, "x") < 0) {
+        return NULL;
+    }
+    if (get_buffer(y_obj, &yb, sizeof(double), 0, "y") < 0) {
+        PyBuffer_Release(&xb);
+        return NULL;
+    }
+    if (!full) {
+        if (get_buffer(lo_obj, &lob, sizeof(Py_ssize_t), 0, "lo") < 0) {
+            goto done;
+        }
+        if (get_buffer(hi_obj, &hib, sizeof(Py_ssize_t), 0, "hi") < 0) {
+            goto done;
+        }
+        lo = (const Py_ssize_t *)lob.buf;
+        hi = (const Py_ssize_t *)hib.buf;
+    }
+
+    x = (const double *)xb.buf;
+    y = (const double *)yb.buf;
+    len_x = xb.len / (Py_ssize_t)sizeof(double) / dim;
+    len_y = yb.len / (Py_ssize_t)sizeof(double) / dim;
+    if (len_x == 0 || len_y == 0) {
+        PyErr_SetString(PyExc_ValueError, "x and y cannot be empty");
+        goto done;
+    }
+
+    if (full) {
+        /* the metrics are symmetric, swapping x and y keeps the costs */
+        if (len_y > len_x) {
+            const double *t = x;
+            Py_ssize_t n = len_x;
+            x = y;
+            y = t;
+            len_x = len_y;
+            len_y = n;
+        }
+        width = len_y;
+    }
+    else {
+        if (lob.len / (Py_ssize_t)sizeof(Py_ssize_t) != len_x ||
+                hib.len / (Py_ssize_t)sizeof(Py_ssize_t) != len_x) {
+            PyErr_SetString(PyExc_ValueError, "window does not match x");
+            goto done;
+        }
+        if (check_window(lo, hi, len_x, len_y) < 0) {
+            goto done;
+        }
+        width = 0;
+        for (i = 0; i < len_x; i++) {
+            if (hi[i] - lo[i] > width) {
+                width = hi[i] - lo[i];
+            }
+        }
+    }
+
+    prev = (double *)malloc(width * sizeof(double));
+    cur = (double *)malloc(width * sizeof(double));
+    scratch = (double *)malloc(dim * sizeof(double));
+    if (prev == NULL || cur == NULL || scratch == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < len_x; i++) {
+        double *t;
+        fill_row(x + i * dim, y, dim, metric, scratch,
+                 full ? 0 : lo[i], full ? len_y : hi[i],
+                 i ? prev : NULL,
+                 i ? (full ? 0 : lo[i - 1]) : -1,
+                 i ? (full ? len_y : hi[i - 1]) : 0,
+                 cur, NULL);
+        t = prev;
+        prev = cur;
+        cur = t;
+    }
+    Py_END_ALLOW_THREADS
+
+    /* the last row ends at column len_y - 1 */
+    result = PyFloat_FromDouble(
+        prev[len_y - 1 - (full ? 0 : lo[len_x - 1])]);
+
+done:
+    free(prev);
+    free(cur);
+    free(scratch);
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&yb);
+    if (lob.obj != NULL) {
+        PyBuffer_Release(&lob);
+    }
+    if (hib.obj != NULL) {
+        PyBuffer_Release(&hib);
+    }
+    return result;
+}
+
+PyDoc_STRVAR(reduce_by_half_doc,
+"reduce_by_half(x, out, dim)\n\n"
+"Average every two consecutive items of x into out. x and out are\n"
+"float64 buffers of len * dim and (len // 2) * dim items.");
+
+static PyObject *
+cdtw_reduce_by_half(PyObject *self, PyObject *args)
+{
+    PyObject *x_obj, *out_obj;
+    Py_buffer xb, ob;
+    Py_ssize_t dim, len_x, i, k;
+
+    if (!PyArg_ParseTuple(args, "OOn", &x_obj, &out_obj, &dim)) {
+        return NULL;
+    }
+    if (dim < 1) {
+        PyErr_SetString(PyExc_ValueError, "dim must be positive");
+        return NULL;
+    }
+    if (get_buffer(x_obj, &xb, sizeof(double), 0, "x") < 0) {
+        return NULL;
+    }
+    if (get_buffer(out_obj, &ob, sizeof(double), 1, "out") < 0) {
+        PyBuffer_Release(&xb);
+        return NULL;
+    }
+    len_x = xb.len / (Py_ssize_t)sizeof(double) / dim;
+    if (ob.len / (Py_ssize_t)sizeof(double) != (len_x / 2) * dim) {
+        PyErr_SetString(PyExc_ValueError, "out has the wrong size");
+        PyBuffer_Release(&xb);
+        PyBuffer_Release(&ob);
+        return NULL;
+    }
+    {
+        const double *x = (const double *)xb.buf;
+        double *out = (double *)ob.buf;
+        for (i = 0; i < len_x / 2; i++) {
+            for (k = 0; k < dim; k++) {
+                out[i * dim + k] =
+                    (x[2 * i * dim + k] + x[(2 * i + 1) * dim + k]) / 2;
+            }
+        }
+    }
+    PyBuffer_Release(&xb);
+    PyBuffer_Release(&ob);
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(expand_window_doc,
+"expand_window(path, len_x, len_y, radius, lo, hi)\n\n"
+"Dilate the coarse path (an intp buffer of (i, j) pairs) by radius,\n"
+"project it onto the 2x finer grid and write the column range of each\n"
+"row into lo and hi (intp buffers of len_x items).");
+
+static PyObject *
+cdtw_expand_window(PyObject *self, PyObject *args)
+{
+    PyObject *path_obj, *lo_obj, *hi_obj;
+    Py_buffer pb, lob, hib;
+    Py_ssize_t len_x, len_y, radius, n, rows, i, r, start_j, last_i, last_j;
+    Py_ssize_t *cmin = NULL, *cmax = NULL;
+    int ok = 0;
+
+    if (!PyArg_ParseTuple(args, "OnnnOO", &path_obj, &len_x, &len_y, &radius,
+                          &lo_obj, &hi_obj)) {
+        return NULL;
+    }
+    if (get_buffer(path_obj, &pb, sizeof(Py_ssize_t), 0, "path") < 0) {
+        return NULL;
+    }
+    if (get_buffer(lo_obj, &lob, sizeof(Py_ssize_t), 1, "lo") < 0) {
+        PyBuffer_Release(&pb);
+        return NULL;
+    }
+    if (get_buffer(hi_obj, &hib, sizeof(Py_ssize_t), 1, "hi") < 0) {
+        PyBuffer_Release(&pb);
+        PyBuffer_Release(&lob);
+        return NULL;
+    }
+
+    {
+        const Py_ssize_t *path = (const Py_ssize_t *)pb.buf;
+        Py_ssize_t *lo = (Py_ssize_t *)lob.buf;
+        Py_ssize_t *hi = (Py_ssize_t *)hib.buf;
+
+        n = pb.len / (Py_ssize_t)sizeof(Py_ssize_t) / 2;
+        if (lob.len / (Py_ssize_t)sizeof(Py_ssize_t) != len_x ||
+                hib.len / (Py_ssize_t)sizeof(Py_ssize_t) != len_x) {
+            PyErr_SetString(PyExc_ValueError, "lo and hi must hold len_x items");
+            goto done;
+        }
+
+        /* column range of every coarse row once the path is dilated. the
+         * path is connected and monotone, so each range is contiguous. */
+        rows = (len_x + 1) / 2;
+        cmin = (Py_ssize_t *)malloc((rows + 1) * sizeof(Py_ssize_t));
+        cmax = (Py_ssize_t *)malloc((rows + 1) * sizeof(Py_ssize_t));
+        if (cmin == NULL || cmax == NULL) {
+            PyErr_NoMemory();
+            goto done;
+        }
+        for (r = 0; r < rows; r++) {
+            cmin[r] = PY_SSIZE_T_MAX;
+            cmax[r] = PY_SSIZE_T_MIN;
+        }
+        for (i = 0; i < n; i++) {
+            Py_ssize_t pi = path[2 * i], pj = path[2 * i + 1];
+            Py_ssize_t first = pi - radius < 0 ? 0 : pi - radius;
+            Py_ssize_t last = pi + radius >= rows ? rows - 1 : pi + radius;
+            for (r = first; r <= last; r++) {
+                if (pj - radius < cmin[r]) {
+                    cmin[r] = pj - radius;
+                }
+                if (pj + radius > cmax[r]) {
+                    cmax[r] = pj + radius;
+                }
+            }
+        }
+
+        /* an odd len_x (len_y) leaves a fine row (column) past the coarse
+         * grid. without a radius reaching it, it gets the columns (rows)
+         * of the last coarse row (column) of the path. */
+        last_i = n > 0 ? path[2 * n - 2] : 0;
+        last_j = n > 0 ? path[2 * n - 1] : 0;
+        if (n > 0 && last_i + 1 < rows && cmin[last_i + 1] > cmax[last_i + 1]) {
+            cmin[last_i + 1] = cmin[last_i];
+            cmax[last_i + 1] = cmax[last_i];
+        }
+
+        /* every row starts searching where the previous row started */
+        start_j = 0;
+        for (i = 0; i < len_x; i++) {
+            Py_ssize_t a, b;
+            r = i / 2;
+            if (cmin[r] > cmax[r]) {
+                PyErr_Format(PyExc_ValueError, "window is empty at row %zd", i);
+                goto done;
+            }
+            a = 2 * cmin[r] < start_j ? start_j : 2 * cmin[r];
+            b = 2 * cmax[r] + 1 >= len_y ? len_y - 1 : 2 * cmax[r] + 1;
+            if (n > 0 && cmax[r] - radius == last_j) {
+                b = len_y - 1;
+            }
+            if (a > b) {
+                PyErr_Format(PyExc_ValueError, "window is empty at row %zd", i);
+                goto done;
+            }
+            lo[i] = a;
+            hi[i] = b + 1;
+            start_j = a;
+        }
+        ok = 1;
+    }
+
+done:
+    free(cmin);
+    free(cmax);
+    PyBuffer_Release(&pb);
+    PyBuffer_Release(&lob);
+    PyBuffer_Release(&hib);
+    if (!ok) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef cdtw_methods[] = {
+    {"dtw", cdtw_dtw, METH_VARARGS, dtw_doc},
+    {"dtw_distance", cdtw_dtw_distance, METH_VARARGS, dtw_distance_doc},
+    {"reduce_by_half", cdtw_reduce_by_half, METH_VARARGS,
+     reduce_by_half_doc},
+    {"expand_window", cdtw_expand_window, METH_VARARGS, expand_window_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef cdtw_module = {
+    PyModuleDef_HEAD_INIT,
+    "_cdtw",
+    "Compiled kernels for fastdtw.",
+    -1,
+    cdtw_methods
+};
+
+PyMODINIT_FUNC
+PyInit__cdtw(void)
+{
+    return PyModule_Create(&cdtw_module);
+}
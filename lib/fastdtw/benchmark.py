@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' compare the array based DTW engine against the previous pure Python
+    implementation (defaultdict cost table), kept below as a reference.
+
+    run from lib/:
+        python -m fastdtw.benchmark --sizes 500 1000 2000 --radius 1
+'''
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import time
+import numpy as np
+from collections import defaultdict
+
+from . import fastdtw, dtw, backend
+
+
+def _legacy_dtw(x, y, window, dist):
+    len_x, len_y = len(x), len(y)
+    if window is None:
+        window = [(i, j) for i in range(len_x) for j in range(len_y)]
+    window = ((i + 1, j + 1) for i, j in window)
+    D = defaultdict(lambda: (float('inf'),))
+    D[0, 0] = (0, 0, 0)
+    for i, j in window:
+        dt = dist(x[i-1], y[j-1])
+        D[i, j] = min((D[i-1, j][0]+dt, i-1, j), (D[i, j-1][0]+dt, i, j-1),
+                      (D[i-1, j-1][0]+dt, i-1, j-1), key=lambda a: a[0])
+    path = []
+    i, j = len_x, len_y
+    while not (i == j == 0):
+        path.append((i-1, j-1))
+        i, j = D[i, j][1], D[i, j][2]
+    path.reverse()
+    return (D[len_x, len_y][0], path)
+
+
+def _legacy_expand_window(path, len_x, len_y, radius):
+    path_ = set(path)
+    for i, j in path:
+        for a, b in ((i + a, j + b)
+                     for a in range(-radius, radius+1)
+                     for b in range(-radius, radius+1)):
+            path_.add((a, b))
+
+    window_ = set()
+    for i, j in path_:
+        for a, b in ((i * 2, j * 2), (i * 2, j * 2 + 1),
+                     (i * 2 + 1, j * 2), (i * 2 + 1, j * 2 + 1)):
+            window_.add((a, b))
+
+    window = []
+    start_j = 0
+    for i in range(0, len_x):
+        new_start_j = None
+        for j in range(start_j, len_y):
+            if (i, j) in window_:
+                window.append((i, j))
+                if new_start_j is None:
+                    new_start_j = j
+            elif new_start_j is not None:
+                break
+        start_j = new_start_j
+
+    return window
+
+
+def _legacy_fastdtw(x, y, radius, dist):
+    if len(x) < radius + 2 or len(y) < radius + 2:
+        return _legacy_dtw(x, y, None, dist)
+    x_shrinked = [(x[i] + x[1+i]) / 2 for i in range(0, len(x) - len(x) % 2, 2)]
+    y_shrinked = [(y[i] + y[1+i]) / 2 for i in range(0, len(y) - len(y) % 2, 2)]
+    _, path = _legacy_fastdtw(x_shrinked, y_shrinked, radius, dist)
+    window = _legacy_expand_window(path, len(x), len(y), radius)
+    return _legacy_dtw(x, y, window, dist)
+
+
+def _timeit(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def _series(n, seed):
+    # something that looks like a daily load curve plus noise
+    rs = np.random.RandomState(seed)
+    t = np.linspace(0, 2 * np.pi, n)
+    return np.sin(t + rs.rand()) * 10 + rs.randn(n)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DTW engines')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[250, 1000, 4000])
+    parser.add_argument('--radius', type=int, default=1)
+    parser.add_argument('--exact-max', type=int, default=1000,
+                        help='largest size to run the exact dtw on')
+    args = parser.parse_args()
+
+    print('backend: {}'.format(backend))
+    difference = lambda a, b: abs(a - b)
+    row = '{:>8} {:>8} {:>12} {:>12} {:>8} {:>6}'
+    print(row.format('method', 'size', 'legacy (s)', 'engine (s)',
+                     'speedup', 'same'))
+    for n in args.sizes:
+        x, y = _series(n, 0), _series(n, 1)
+        runs = [('fastdtw',
+                 lambda: _legacy_fastdtw(x, y, args.radius, difference),
+                 lambda: fastdtw(x, y, radius=args.radius))]
+        if n <= args.exact_max:
+            runs.append(('dtw',
+                         lambda: _legacy_dtw(x, y, None, difference),
+                         lambda: dtw(x, y)))
+        for name, legacy, new in runs:
+            t_old, r_old = _timeit(legacy)
+            t_new, r_new = _timeit(new)
+            same = r_old[0] == r_new[0] and r_old[1] == r_new[1]
+            print(row.format(name, n, '{:.3f}'.format(t_old),
+                             '{:.3f}'.format(t_new),
+                             '{:.1f}x'.format(t_old / max(t_new, 1e-9)),
+                             str(same)))
+
+
+if __name__ == '__main__':
+    main()
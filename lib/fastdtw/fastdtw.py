@@ -4,15 +4,36 @@
 from __future__ import absolute_import, division
 import numbers
 import numpy as np
-from collections import defaultdict
 
 try:
     range = xrange
 except NameError:
     pass
 
+try:
+    from . import _cdtw
+except ImportError:
+    _cdtw = None
+
+# engine behind __dtw, __expand_window and __reduce_by_half. the compiled
+# kernels cover abs() for 1-D series and the 1 and inf norms for 2-D ones,
+# other distances always run in Python. build them with
+# `python setup.py build_ext --inplace` from lib/.
+backend = 'python' if _cdtw is None else 'c'
+
+
+# steps stored in the direction matrix, i.e. where the cheapest
+# path into a cell came from.
+_UP, _LEFT, _DIAG = 0, 1, 2
+
+# metrics understood by _cdtw.dtw
+_L1, _LINF = 0, 1
+
+# number of cells whose distances are computed in one vectorized call
+_CHUNK_CELLS = 1 << 16
 
-def fastdtw(x, y, radius=1, dist=None):
+
+def fastdtw(x, y, radius=1, dist=None, return_path=True):
     ''' return the approximate distance between 2 time series with O(N)
         time and memory complexity
 
@@ -32,13 +53,18 @@ def fastdtw(x, y, radius=1, dist=None):
             dist is an int of value p > 0, then the p-norm will be used. If
             dist is a function then dist(x[i], y[j]) will be used. If dist is
             None then abs(x[i] - y[j]) will be used.
+        return_path : bool
+            If False, only the distance is returned and the path is not
+            reconstructed, which keeps two rows of costs instead of the
+            whole cost table.
 
         Returns
         -------
         distance : float
             the approximate distance between the 2 time series
         path : list
-            list of indexes for the inputs x and y
+            list of indexes for the inputs x and y, not returned if
+            return_path is False
 
         Examples
         --------
@@ -48,9 +74,11 @@ def fastdtw(x, y, radius=1, dist=None):
         >>> y = np.array([2, 3, 4], dtype='float')
         >>> fastdtw.fastdtw(x, y)
         (2.0, [(0, 0), (1, 0), (2, 1), (3, 2), (4, 2)])
+        >>> fastdtw.fastdtw(x, y, return_path=False)
+        2.0
     '''
     x, y, dist = __prep_inputs(x, y, dist)
-    return __fastdtw(x, y, radius, dist)
+    return __fastdtw(x, y, radius, dist, return_path)
 
 
 def __difference(a, b):
@@ -58,21 +86,59 @@ def __difference(a, b):
 
 
 def __norm(p):
-    return lambda a, b: np.linalg.norm(a - b, p)
+    def norm(a, b):
+        return np.linalg.norm(a - b, p)
+    norm.p = p
+    return norm
+
+
+def __dist_cells(dist, x, y, rows, cols):
+    ''' distances between x[rows] and y[cols] as a float64 array.
+        abs() and the 1 and inf norms are vectorized, anything else is
+        called once per cell; np.linalg.norm of a single vector takes
+        other code paths for the remaining orders and the results would
+        differ in the last bits.
+    '''
+    if dist is __difference:
+        return np.abs(x[rows] - y[cols])
+    if x.ndim > 1 and getattr(dist, 'p', None) in (1, np.inf):
+        return np.linalg.norm(x[rows] - y[cols], dist.p, axis=-1)
+    return np.fromiter((dist(x[i], y[j]) for i, j in zip(rows, cols)),
+                       dtype=np.float64, count=len(rows))
+
+
+def __c_metric(x, y, dist):
+    ''' the _cdtw metric matching dist, None if the compiled kernels
+        are not available or cannot compute dist.
+    '''
+    if _cdtw is None or x.ndim != y.ndim:
+        return None
+    if dist is __difference and x.ndim == 1:
+        return _L1
+    if x.ndim == 2 and getattr(dist, 'p', None) == 1:
+        return _L1
+    if x.ndim == 2 and getattr(dist, 'p', None) == np.inf:
+        return _LINF
+    return None
+
 
+def __dim(x):
+    return 1 if x.ndim == 1 else x.shape[1]
 
-def __fastdtw(x, y, radius, dist):
+
+def __fastdtw(x, y, radius, dist, return_path=True):
     min_time_size = radius + 2
 
     if len(x) < min_time_size or len(y) < min_time_size:
-        return dtw(x, y, dist=dist)
+        return __dtw(x, y, None, dist, return_path)
 
+    # the coarser levels always need their path to project the window
     x_shrinked = __reduce_by_half(x)
     y_shrinked = __reduce_by_half(y)
     distance, path = \
         __fastdtw(x_shrinked, y_shrinked, radius=radius, dist=dist)
     window = __expand_window(path, len(x), len(y), radius)
-    return __dtw(x, y, window, dist=dist)
+    return __dtw(x, y, window, dist, return_path)
 
 
 def __prep_inputs(x, y, dist):
@@ -95,7 +161,7 @@ def __prep_inputs(x, y, dist):
     return x, y, dist
 
 
-def dtw(x, y, dist=None):
+def dtw(x, y, dist=None, return_path=True):
     ''' return the distance between 2 time series without approximation
 
         Parameters
@@ -109,13 +175,18 @@ def dtw(x, y, dist=None):
             dist is an int of value p > 0, then the p-norm will be used. If
             dist is a function then dist(x[i], y[j]) will be used. If dist is
             None then abs(x[i] - y[j]) will be used.
+        return_path : bool
+            If False, only the distance is returned and the path is not
+            reconstructed, which keeps two rows of costs instead of the
+            whole cost table.
 
         Returns
         -------
         distance : float
             the approximate distance between the 2 time series
         path : list
-            list of indexes for the inputs x and y
+            list of indexes for the inputs x and y, not returned if
+            return_path is False
 
         Examples
         --------
@@ -125,60 +196,209 @@ def dtw(x, y, dist=None):
         >>> y = np.array([2, 3, 4], dtype='float')
         >>> fastdtw.dtw(x, y)
         (2.0, [(0, 0), (1, 0), (2, 1), (3, 2), (4, 2)])
+        >>> fastdtw.dtw(x, y, return_path=False)
+        2.0
     '''
     x, y, dist = __prep_inputs(x, y, dist)
-    return __dtw(x, y, None, dist)
+    return __dtw(x, y, None, dist, return_path)
 
 
-def __dtw(x, y, window, dist):
+def __dtw(x, y, window, dist, return_path=True):
     len_x, len_y = len(x), len(y)
+    if window is not None:
+        lo, hi = window
+        if lo[0] != 0 or hi[-1] != len_y:
+            raise ValueError('window must contain both corners')
+    if not return_path:
+        return __dtw_distance(x, y, window, dist)
     if window is None:
-        window = [(i, j) for i in range(len_x) for j in range(len_y)]
-    window = ((i + 1, j + 1) for i, j in window)
-    D = defaultdict(lambda: (float('inf'),))
-    D[0, 0] = (0, 0, 0)
-    for i, j in window:
-        dt = dist(x[i-1], y[j-1])
-        D[i, j] = min((D[i-1, j][0]+dt, i-1, j), (D[i, j-1][0]+dt, i, j-1),
-                      (D[i-1, j-1][0]+dt, i-1, j-1), key=lambda a: a[0])
+        lo = np.zeros(len_x, dtype=np.intp)
+        hi = np.full(len_x, len_y, dtype=np.intp)
+
+    metric = __c_metric(x, y, dist)
+    if metric is not None:
+        return _cdtw.dtw(np.ascontiguousarray(x), np.ascontiguousarray(y),
+                         lo, hi, __dim(x), metric)
+
+    # the window is stored row by row; row i holds the columns
+    # lo[i]..hi[i]-1 starting at offsets[i].
+    offsets = np.zeros(len_x + 1, dtype=np.intp)
+    np.cumsum(hi - lo, out=offsets[1:])
+    D = np.empty(offsets[-1], dtype=np.float64)
+    steps = np.empty(offsets[-1], dtype=np.int8)
+
+    # row -1 only holds the origin, D[-1, -1] = 0.
+    prev, prev_lo, prev_hi = [0.0], -1, 0
+    rows = __distance_rows(x, y, (lo, hi), dist)
+    for i, (lo_i, hi_i, dts) in enumerate(rows):
+        cost, row_steps = __dtw_row(dts, prev, prev_lo, prev_hi, lo_i, hi_i)
+        D[offsets[i]:offsets[i+1]] = cost
+        steps[offsets[i]:offsets[i+1]] = row_steps
+        prev, prev_lo, prev_hi = cost, lo_i, hi_i
+
     path = []
-    i, j = len_x, len_y
-    while not (i == j == 0):
-        path.append((i-1, j-1))
-        i, j = D[i, j][1], D[i, j][2]
+    i, j = len_x - 1, len_y - 1
+    lo, offsets = lo.tolist(), offsets.tolist()
+    while True:
+        path.append((i, j))
+        step = steps[offsets[i] + j - lo[i]]
+        if step == _UP:
+            i -= 1
+        elif step == _LEFT:
+            j -= 1
+        elif i == j == 0:
+            break
+        else:
+            i, j = i - 1, j - 1
     path.reverse()
-    return (D[len_x, len_y][0], path)
+    return (float(D[-1]), path)
+
+
+def __dtw_distance(x, y, window, dist):
+    ''' the DTW distance alone; only the previous row of costs is kept. '''
+    metric = __c_metric(x, y, dist)
+    if metric is not None:
+        lo, hi = (None, None) if window is None else window
+        return _cdtw.dtw_distance(np.ascontiguousarray(x),
+                                  np.ascontiguousarray(y),
+                                  lo, hi, __dim(x), metric)
+
+    prev, prev_lo, prev_hi = [0.0], -1, 0
+    for lo_i, hi_i, dts in __distance_rows(x, y, window, dist):
+        prev, _ = __dtw_row(dts, prev, prev_lo, prev_hi, lo_i, hi_i)
+        prev_lo, prev_hi = lo_i, hi_i
+    return prev[-1]
+
+
+def __dtw_row(dts, prev, prev_lo, prev_hi, lo_i, hi_i):
+    ''' costs and steps of the row covering columns lo_i..hi_i-1, given
+        the distances of its cells and the costs of the previous row.
+    '''
+    inf = float('inf')
+    width, shift = hi_i - lo_i, lo_i - prev_lo
+
+    # previous row padded with inf so that ups[k] and diags[k] are
+    # the cells above and above-left of column lo_i + k.
+    ext = [inf] + prev + [inf] * max(hi_i - prev_hi + 1, 1)
+    ups = ext[shift+1:shift+1+width]
+    diags = ext[shift:shift+width]
+
+    # ties go to up, then left, then diagonal.
+    cost, steps, left = [], [], inf
+    for d, u, g in zip(dts, ups, diags):
+        u += d
+        l = left + d
+        g += d
+        if u <= l and u <= g:
+            left = u
+            steps.append(_UP)
+        elif l <= g:
+            left = l
+            steps.append(_LEFT)
+        else:
+            left = g
+            steps.append(_DIAG)
+        cost.append(left)
+    return cost, steps
+
+
+def __distance_rows(x, y, window, dist):
+    ''' yield (lo, hi, distances) for every row of the window, computing
+        the distances vectorized in chunks of rows. without a window the
+        longer series runs along the rows so a row holds min(N, M) cells.
+    '''
+    if window is None:
+        transpose = len(y) > len(x)
+        n_rows, width = (len(y), len(x)) if transpose else (len(x), len(y))
+        chunk = max(1, _CHUNK_CELLS // width)
+        for a in range(0, n_rows, chunk):
+            b = min(a + chunk, n_rows)
+            rows = np.repeat(np.arange(a, b), width)
+            cols = np.tile(np.arange(width), b - a)
+            if transpose:
+                rows, cols = cols, rows
+            block = __dist_cells(dist, x, y, rows, cols)
+            for dts in block.reshape(b - a, width).tolist():
+                yield 0, width, dts
+        return
+
+    lo, hi = window
+    widths = hi - lo
+    offsets = np.zeros(len(lo) + 1, dtype=np.intp)
+    np.cumsum(widths, out=offsets[1:])
+    for a, b in __row_chunks(offsets):
+        rows = np.repeat(np.arange(a, b), widths[a:b])
+        cols = np.arange(offsets[a], offsets[b]) - \
+            np.repeat(offsets[a:b] - lo[a:b], widths[a:b])
+        dts = __dist_cells(dist, x, y, rows, cols).tolist()
+        for i in range(a, b):
+            yield (int(lo[i]), int(hi[i]),
+                   dts[offsets[i]-offsets[a]:offsets[i+1]-offsets[a]])
+
+
+def __row_chunks(offsets, cells=None):
+    ''' split the rows into runs of roughly `cells` cells so the vectorized
+        distances never need more than a chunk of temporary memory.
+    '''
+    cells = cells or _CHUNK_CELLS
+    len_x, a = len(offsets) - 1, 0
+    while a < len_x:
+        b = int(np.searchsorted(offsets, offsets[a] + cells, side='right'))
+        b = min(max(b - 1, a + 1), len_x)
+        yield a, b
+        a = b
 
 
 def __reduce_by_half(x):
-    return [(x[i] + x[1+i]) / 2 for i in range(0, len(x) - len(x) % 2, 2)]
+    if _cdtw is not None and x.ndim <= 2:
+        out = np.empty((len(x) // 2,) + x.shape[1:])
+        _cdtw.reduce_by_half(np.ascontiguousarray(x), out, __dim(x))
+        return out
+    n = len(x) - len(x) % 2
+    return (x[0:n:2] + x[1:n:2]) / 2
 
 
 def __expand_window(path, len_x, len_y, radius):
-    path_ = set(path)
-    for i, j in path:
-        for a, b in ((i + a, j + b)
-                     for a in range(-radius, radius+1)
-                     for b in range(-radius, radius+1)):
-            path_.add((a, b))
-
-    window_ = set()
-    for i, j in path_:
-        for a, b in ((i * 2, j * 2), (i * 2, j * 2 + 1),
-                     (i * 2 + 1, j * 2), (i * 2 + 1, j * 2 + 1)):
-            window_.add((a, b))
-
-    window = []
-    start_j = 0
-    for i in range(0, len_x):
-        new_start_j = None
-        for j in range(start_j, len_y):
-            if (i, j) in window_:
-                window.append((i, j))
-                if new_start_j is None:
-                    new_start_j = j
-            elif new_start_j is not None:
-                break
-        start_j = new_start_j
-
-    return window
+    ''' column range [lo, hi) of every row of the finer grid once the
+        coarse path is dilated by radius and projected 2x.
+    '''
+    path = np.asarray(path, dtype=np.intp).reshape(-1, 2)
+    if _cdtw is not None:
+        lo = np.empty(len_x, dtype=np.intp)
+        hi = np.empty(len_x, dtype=np.intp)
+        _cdtw.expand_window(path, len_x, len_y, radius, lo, hi)
+        return lo, hi
+
+    # the path is connected and monotone: coarse row r spans the columns
+    # first[r]..last[r], and once dilated it spans the columns of the
+    # first point of row r - radius to the last point of row r + radius.
+    path_i, path_j = path[:, 0], path[:, 1]
+    coarse_rows = path_i[-1] + 1
+    rows = np.arange(coarse_rows)
+    first = path_j[np.searchsorted(path_i, rows, side='left')]
+    last = path_j[np.searchsorted(path_i, rows, side='right') - 1]
+
+    # coarse row of every fine row, rows past the dilated path are empty
+    r = np.arange(len_x) // 2
+    empty = r > coarse_rows
+    if empty.any():
+        raise ValueError('window is empty at row {}'.format(
+            int(np.argmax(empty))))
+
+    # an odd len_x (len_y) leaves a fine row (column) past the coarse grid.
+    # without a radius reaching it, it gets the columns (rows) of the last
+    # coarse row (column) of the path.
+    r = np.minimum(r, coarse_rows - 1 + radius)
+    a = 2 * (first[np.clip(r - radius, 0, coarse_rows - 1)] - radius)
+    last_r = last[np.clip(r + radius, 0, coarse_rows - 1)]
+    b = 2 * (last_r + radius) + 1
+    b[last_r == path_j[-1]] = len_y - 1
+
+    # each row starts searching where the previous row started
+    lo = np.maximum.accumulate(np.maximum(a, 0))
+    hi = np.minimum(b, len_y - 1) + 1
+    empty = lo >= hi
+    if empty.any():
+        raise ValueError('window is empty at row {}'.format(
+            int(np.argmax(empty))))
+    return lo, hi
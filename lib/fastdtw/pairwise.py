@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' DTW distance matrices between many series, computed on a process pool.
+
+    the series are copied once into a shared memory block that every worker
+    maps, so a task only carries the range of pairs it has to compute.
+'''
+
+from __future__ import absolute_import, division
+import multiprocessing
+import numpy as np
+
+from .fastdtw import fastdtw
+
+# state of the current worker (or of the calling process when n_jobs == 1),
+# set by __init_worker.
+_worker = {}
+
+
+def pdist(series_list, radius=1, dist=None, n_jobs=1, square=False):
+    ''' return the pairwise fastdtw distances between the series in
+        series_list, ordered like scipy.spatial.distance.pdist
+
+        Parameters
+        ----------
+        series_list : list of array_like
+            the series to compare. they may differ in length but the second
+            dimension (if any) must be the same for all of them
+        radius : int
+            see fastdtw.fastdtw
+        dist : function or int
+            see fastdtw.fastdtw. a function must be picklable when n_jobs is
+            not 1, i.e. defined at module level and not a lambda
+        n_jobs : int
+            number of worker processes. -1 or None uses all CPUs and 1 runs
+            in the calling process
+        square : bool
+            return the symmetric n x n matrix instead of the condensed one
+
+        Returns
+        -------
+        distances : ndarray
+            condensed distance matrix of n * (n - 1) / 2 items, the distance
+            between series i < j being at n*i - i*(i+1)/2 + j - i - 1. the
+            n x n matrix if square is set
+
+        Examples
+        --------
+        >>> import fastdtw
+        >>> fastdtw.pdist([[1, 2, 3], [1, 2, 2, 3], [3, 2, 1]])
+        array([0., 4., 4.])
+    '''
+    n = len(series_list)
+    distances = __run(series_list, 'pdist', n, n * (n - 1) // 2,
+                      radius, dist, n_jobs)
+    if not square:
+        return distances
+    matrix = np.zeros((n, n))
+    upper = np.triu_indices(n, 1)
+    matrix[upper] = distances
+    matrix.T[upper] = distances
+    return matrix
+
+
+def cdist(xa, xb=None, radius=1, dist=None, n_jobs=1):
+    ''' return the fastdtw distance between each series of xa and each
+        series of xb
+
+        Parameters
+        ----------
+        xa : list of array_like
+            input series
+        xb : list of array_like
+            input series. if None, the symmetric matrix between the series
+            of xa is returned and only its upper triangle is computed
+        radius, dist, n_jobs :
+            see pdist
+
+        Returns
+        -------
+        distances : ndarray
+            len(xa) x len(xb) matrix
+
+        Examples
+        --------
+        >>> import fastdtw
+        >>> fastdtw.cdist([[1, 2, 3]], [[1, 2, 2, 3], [3, 2, 1]])
+        array([[0., 4.]])
+    '''
+    if xb is None:
+        return pdist(xa, radius=radius, dist=dist, n_jobs=n_jobs,
+                     square=True)
+    na, nb = len(xa), len(xb)
+    distances = __run(list(xa) + list(xb), 'cdist', na, na * nb,
+                      radius, dist, n_jobs)
+    return distances.reshape(na, nb)
+
+
+def __pack(series_list):
+    series_list = [np.asanyarray(s, dtype='float') for s in series_list]
+    trailing = series_list[0].shape[1:] if series_list else ()
+    for s in series_list:
+        if s.shape[1:] != trailing:
+            raise ValueError('second dimension of all series must be the same')
+    offsets = np.zeros(len(series_list) + 1, dtype=np.intp)
+    np.cumsum([len(s) for s in series_list], out=offsets[1:])
+    return series_list, offsets, trailing
+
+
+def __run(series_list, mode, n, n_pairs, radius, dist, n_jobs):
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = max(1, min(n_jobs, n_pairs))
+    series_list, offsets, trailing = __pack(series_list)
+    shape = (int(offsets[-1]),) + trailing
+
+    if n_jobs == 1:
+        data = np.concatenate(series_list) if series_list else np.empty(shape)
+        __init_worker(None, data, shape, offsets, mode, n, radius, dist)
+        try:
+            return __work((0, n_pairs))
+        finally:
+            _worker.clear()
+
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(
+        create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for s, start in zip(series_list, offsets):
+            data[start:start+len(s)] = s
+        del data
+
+        # a few chunks per worker evens out the series of unequal cost
+        bounds = np.linspace(0, n_pairs, n_jobs * 4 + 1).astype(np.intp)
+        tasks = [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])
+                 if a < b]
+        pool = multiprocessing.Pool(
+            n_jobs, initializer=__init_worker,
+            initargs=(shm.name, None, shape, offsets, mode, n, radius, dist))
+        try:
+            chunks = pool.map(__work, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shm.close()
+        shm.unlink()
+    return np.concatenate(chunks)
+
+
+def __init_worker(name, data, shape, offsets, mode, n, radius, dist):
+    if name is not None:
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=name)
+        data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        _worker['shm'] = shm
+    _worker.update(data=data, offsets=offsets, mode=mode, n=n,
+                   radius=radius, dist=dist)
+
+
+def __work(task):
+    start, stop = task
+    data, offsets = _worker['data'], _worker['offsets']
+    radius, dist = _worker['radius'], _worker['dist']
+    distances = np.empty(stop - start)
+    for k, (i, j) in enumerate(__pairs(start, stop)):
+        distances[k] = fastdtw(data[offsets[i]:offsets[i+1]],
+                               data[offsets[j]:offsets[j+1]],
+                               radius=radius, dist=dist, return_path=False)
+    return distances
+
+
+def __pairs(start, stop):
+    ''' the (i, j) series indices of the pairs start..stop-1 '''
+    mode, n = _worker['mode'], _worker['n']
+    if mode == 'cdist':
+        nb = len(_worker['offsets']) - 1 - n
+        for k in range(start, stop):
+            yield k // nb, n + k % nb
+        return
+    if start >= stop:
+        return
+
+    # row of the condensed index `start`, then walk along the triangle
+    i = int(n - 2 - np.floor(np.sqrt(-8 * start + 4 * n * (n - 1) - 7) / 2
+                             - 0.5))
+    j = start + i + 1 - n * (n - 1) // 2 + (n - i) * (n - i - 1) // 2
+    for _ in range(start, stop):
+        yield i, j
+        j += 1
+        if j == n:
+            i += 1
+            j = i + 1
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' nearest neighbour search under fastdtw with lower bound pruning.
+
+    candidates are visited by increasing LB_Kim and a full fastdtw only
+    runs when neither LB_Kim nor LB_Keogh already exceeds the distance of
+    the current k-th best candidate. both bounds hold for the abs()
+    distance used on 1-D series.
+'''
+
+from __future__ import absolute_import, division
+import heapq
+import numpy as np
+
+from .fastdtw import fastdtw
+
+
+def lb_envelopes(candidates, window=None):
+    ''' return the LB_Keogh (lower, upper) envelope of every candidate
+
+        Parameters
+        ----------
+        candidates : list of array_like
+            1-D input series
+        window : int
+            half width of the envelope. None uses the whole series, which
+            bounds any warping path; a smaller window only bounds the paths
+            that stay within `window` steps of the diagonal (Sakoe-Chiba
+            band) and requires the query to have the candidates' length
+
+        Returns
+        -------
+        envelopes : list of tuple
+            (lower, upper) arrays, of length 1 if window is None
+    '''
+    envelopes = []
+    for c in candidates:
+        c = __prep_series(c)
+        if window is None or window >= len(c):
+            envelopes.append((c.min(keepdims=True), c.max(keepdims=True)))
+            continue
+        padded = np.pad(c, window, mode='edge')
+        frames = np.lib.stride_tricks.sliding_window_view(
+            padded, 2 * window + 1)
+        envelopes.append((frames.min(axis=1), frames.max(axis=1)))
+    return envelopes
+
+
+def knn(query, candidates, k=1, radius=1, window=None, envelopes=None):
+    ''' return the k candidates closest to query under fastdtw
+
+        Parameters
+        ----------
+        query : array_like
+            1-D input series
+        candidates : list of array_like
+            1-D series to search
+        k : int
+            number of neighbours, at least 1. all the candidates are
+            returned if there are fewer than k
+        radius : int
+            see fastdtw.fastdtw
+        window : int
+            see lb_envelopes. the search is exact (same neighbours as running
+            fastdtw on every candidate) when window is None
+        envelopes : list of tuple
+            the lb_envelopes of candidates for this window, to reuse them
+            across queries against the same candidates
+
+        Returns
+        -------
+        indices : list
+            indexes of the k nearest candidates, closest first
+        distances : list
+            their fastdtw distances
+        stats : dict
+            number of candidates, how many were pruned by LB_Kim and by
+            LB_Keogh and how many needed a full fastdtw
+
+        Examples
+        --------
+        >>> import fastdtw
+        >>> fastdtw.knn([1, 2, 3], [[3, 2, 1], [1, 2, 2, 3], [5, 6, 7]], k=1)
+        ([1], [0.0], {'candidates': 3, 'lb_kim': 2, 'lb_keogh': 0, 'dtw': 1})
+    '''
+    if k < 1:
+        raise ValueError('k must be at least 1')
+    query = __prep_series(query)
+    candidates = [__prep_series(c) for c in candidates]
+    if envelopes is None:
+        envelopes = lb_envelopes(candidates, window)
+    if len(envelopes) != len(candidates):
+        raise ValueError('envelopes do not match the candidates')
+    for lower, _ in envelopes:
+        if len(lower) != 1 and len(lower) != len(query):
+            raise ValueError('a windowed envelope needs equal length series')
+
+    stats = {'candidates': len(candidates), 'lb_kim': 0, 'lb_keogh': 0,
+             'dtw': 0}
+    lb_kim = np.array([__lb_kim(query, c) for c in candidates])
+
+    # max-heap of the best k so far, as (-distance, -index)
+    best = []
+    for idx in np.argsort(lb_kim, kind='stable'):
+        idx = int(idx)
+        bound = best[0][0] * -1 if len(best) == k else float('inf')
+        if lb_kim[idx] > bound:
+            stats['lb_kim'] += 1
+            continue
+        if __lb_keogh(query, *envelopes[idx]) > bound:
+            stats['lb_keogh'] += 1
+            continue
+        stats['dtw'] += 1
+        distance = fastdtw(query, candidates[idx], radius=radius,
+                           return_path=False)
+        item = (-distance, -idx)
+        if len(best) < k:
+            heapq.heappush(best, item)
+        elif item > best[0]:
+            heapq.heapreplace(best, item)
+
+    best = sorted((-d, -i) for d, i in best)
+    return [i for _, i in best], [d for d, _ in best], stats
+
+
+def __prep_series(x):
+    x = np.asanyarray(x, dtype='float')
+    if x.ndim != 1:
+        raise ValueError('knn only supports 1-D series')
+    if len(x) == 0:
+        raise ValueError('series cannot be empty')
+    return x
+
+
+def __lb_kim(q, c):
+    # every warping path starts in the first and ends in the last cell
+    bound = abs(q[0] - c[0])
+    if len(q) > 1 or len(c) > 1:
+        bound += abs(q[-1] - c[-1])
+    return bound
+
+
+def __lb_keogh(q, lower, upper):
+    # every point of q is matched to at least one point inside its envelope
+    return float(np.sum(np.maximum(q - upper, 0) + np.maximum(lower - q, 0)))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' subsequence DTW over a stream (SPRING, Sakurai et al. 2007).
+
+    the stream is matched against a fixed reference one point at a time:
+    every new point extends the cost matrix by a single column of
+    len(reference) cells, so a sample costs O(len(reference)) no matter
+    how long the stream has been running.
+'''
+
+from __future__ import absolute_import, division
+import numbers
+import numpy as np
+
+
+class StreamingSubsequenceDTW(object):
+    ''' report the subsequences of a stream whose DTW distance to reference
+        is at most threshold
+
+        Overlapping candidates are resolved as in SPRING: a match is only
+        reported once no later point can extend it into a better one, and
+        the reported matches never overlap.
+
+        Parameters
+        ----------
+        reference : array_like
+            the pattern to look for, e.g. a known fault signature
+        threshold : float
+            largest DTW distance reported as a match
+        dist : function or int
+            see fastdtw.fastdtw
+
+        Examples
+        --------
+        >>> import fastdtw
+        >>> matcher = fastdtw.StreamingSubsequenceDTW([1, 2, 3], threshold=1)
+        >>> matcher.update([5, 5, 1, 2, 3, 5, 5])
+        [(2, 4, 0.0)]
+    '''
+
+    def __init__(self, reference, threshold, dist=None):
+        self.reference = np.asanyarray(reference, dtype='float')
+        if len(self.reference) == 0:
+            raise ValueError('reference cannot be empty')
+        if isinstance(dist, numbers.Number) and dist <= 0:
+            raise ValueError('dist cannot be a negative integer')
+        self.threshold = threshold
+        self.dist = dist
+
+        # points seen so far, i.e. the stream index of the next point
+        self.t = 0
+
+        # last column of the cost matrix (cell 0 is the free start) and the
+        # stream index where the path into each cell started
+        m = len(self.reference)
+        self._d = [0.0] + [float('inf')] * m
+        self._s = [0] * (m + 1)
+
+        # best candidate not reported yet
+        self._dmin = float('inf')
+        self._ts = self._te = None
+
+    def update(self, new_points):
+        ''' feed new points of the stream
+
+            Parameters
+            ----------
+            new_points : array_like
+                points in stream order, a single point is accepted too
+
+            Returns
+            -------
+            matches : list
+                (start, end, distance) of the matches confirmed by these
+                points; start and end are inclusive stream indices
+        '''
+        new_points = np.asanyarray(new_points, dtype='float')
+        if new_points.ndim < self.reference.ndim:
+            new_points = new_points[np.newaxis]
+
+        matches = []
+        inf = float('inf')
+        for x in new_points:
+            t = self.t
+            dts = self.__distances(x)
+
+            # new column; ties keep the earliest of left, up, diagonal
+            d_prev, s_prev = self._d, self._s
+            d, s = [0.0], [t]
+            for i in range(1, len(d_prev)):
+                best, start = d[i-1], s[i-1]
+                if d_prev[i] < best:
+                    best, start = d_prev[i], s_prev[i]
+                if d_prev[i-1] < best:
+                    best, start = d_prev[i-1], s_prev[i-1]
+                d.append(dts[i-1] + best)
+                s.append(start)
+
+            # the pending match is final once no path that could still
+            # improve on it starts inside it
+            if self._dmin <= self.threshold:
+                te = self._te
+                if all(d_ >= self._dmin or s_ > te
+                       for d_, s_ in zip(d[1:], s[1:])):
+                    matches.append((self._ts, te, self._dmin))
+                    self._dmin = inf
+                    for i in range(1, len(d)):
+                        if s[i] <= te:
+                            d[i] = inf
+
+            if d[-1] <= self.threshold and d[-1] < self._dmin:
+                self._dmin, self._ts, self._te = d[-1], s[-1], t
+
+            self._d, self._s = d, s
+            self.t += 1
+        return matches
+
+    def flush(self):
+        ''' return the pending match as if the stream ended here
+
+            Returns
+            -------
+            matches : list
+                the pending (start, end, distance), if any
+        '''
+        if self._dmin > self.threshold:
+            return []
+        match = (self._ts, self._te, self._dmin)
+        self._dmin = float('inf')
+        self._d = [0.0] + [d if s > match[1] else float('inf')
+                           for d, s in zip(self._d[1:], self._s[1:])]
+        return [match]
+
+    def __distances(self, x):
+        ref, dist = self.reference, self.dist
+        if dist is None:
+            if ref.ndim == 1:
+                return np.abs(ref - x).tolist()
+            dist = 1
+        if isinstance(dist, numbers.Number):
+            return np.linalg.norm(ref - x, dist, axis=-1).tolist()
+        return [dist(x, r) for r in ref]
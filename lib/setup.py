@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+''' build the compiled fastdtw kernels next to the sources:
+
+        python setup.py build_ext --inplace
+
+    only a C compiler and the Python headers are needed. without the
+    build fastdtw runs on its pure Python engine, see fastdtw.backend.
+'''
+
+from setuptools import setup, Extension
+
+setup(
+    name='fastdtw',
+    packages=['fastdtw'],
+    ext_modules=[
+        Extension('fastdtw._cdtw', sources=['fastdtw/_cdtw.c'],
+                  extra_compile_args=['-O3']),
+    ],
+)
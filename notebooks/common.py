@@ -2,36 +2,142 @@
 # They are kind of dirty but get the job done.
 import pandas as pd
 import numpy as np
+import hashlib
+import json
 import glob
 import os
+import shutil
+import sys
+import tempfile
+import time
 
-from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from sklearn import preprocessing
 
+# preprocess_pipeline, the feature windows and keras shapes are the
+# dashboard's, one implementation for both
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "dashboard"))
+from process import PIPELINE_STEPS, Reshape, feature_batches, preprocess_pipeline, sliding_windows
+
+# keras is only needed to train on a KerasSequence
+try:
+    from keras.utils import Sequence
+except ImportError:
+    Sequence = object
+
 
 ## load data
 
-@lru_cache(maxsize=None)
-def load_df(src, pattern):
+# parsed frames are cached on disk as one .npy file per column so that
+# a fresh kernel can skip the CSV parsing. set CHILLER_CACHE_DIR to move it.
+CACHE_DIR = os.environ.get(
+    "CHILLER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+# every call returns a frame of its own. repeated loads are read from the
+# .npy cache instead of being kept in memory.
+# usecols    := list of columns to load (all by default), "Time Stamp" is always read
+# float32    := store sensor values as float32 instead of float64
+# n_jobs     := number of processes parsing the files
+# verbose    := print the parse time of every file
+def load_df(src, pattern, cache=True, usecols=None, float32=False, n_jobs=1, verbose=False):
     all_files = glob.glob(os.path.join(src, pattern))
-    df = pd.concat([pd.read_csv(f, low_memory=False) for f in all_files], ignore_index=True)
+    if usecols is not None:
+        usecols = tuple(usecols)
 
-    # minor changes
-    df = df.rename(columns={"Time Stamp": "timestamp"})
-    df = df.replace("\\N", np.nan)
+    # reuse the cached frame as long as no source file changed
+    cache_path = _cache_path(src, pattern, usecols, float32)
+    key = _cache_key(all_files)
+    if cache:
+        df = _read_cache(cache_path, key)
+        if df is not None:
+            return df
 
-    # update data types. object is taken as default
-    dtypes = dict([(col, np.float64) for col in df.columns])
-    dtypes["timestamp"] = "datetime64[ns]"
-    df = df.astype(dtypes)
+    # the parser takes care of "\\N" and the dtypes, so no object columns
+    # are built. files are parsed in parallel.
+    read = partial(_read_csv, usecols=usecols, dtype=np.float32 if float32 else np.float64)
+    if n_jobs == 1:
+        parsed = [read(f) for f in all_files]
+    else:
+        with ProcessPoolExecutor(n_jobs) as pool:
+            parsed = list(pool.map(read, all_files))
+
+    frames = []
+    for f, (df, seconds) in zip(all_files, parsed):
+        if verbose:
+            print("{}: {} rows in {:.2f}s".format(os.path.basename(f), df.shape[0], seconds))
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    del frames, parsed
 
     # change the index to timestamp.
+    df = df.rename(columns={"Time Stamp": "timestamp"})
     df.index = df.timestamp
     df = df.drop("timestamp", axis=1)
-    
+
+    if cache:
+        _write_cache(cache_path, key, df)
     return df
 
 
+# parse one CSV with typed columns. returns the frame and the time it took
+def _read_csv(path, usecols=None, dtype=np.float64):
+    start = time.time()
+    header = pd.read_csv(path, nrows=0).columns
+    if usecols is not None:
+        header = [c for c in header if c == "Time Stamp" or c in usecols]
+    dtypes = dict((c, dtype) for c in header if c != "Time Stamp")
+    df = pd.read_csv(path, usecols=header, dtype=dtypes, na_values="\\N")
+    df["Time Stamp"] = pd.to_datetime(df["Time Stamp"])
+    return df, time.time() - start
+
+
+# one cache directory per load_df call, overwritten when the key changes
+def _cache_path(src, pattern, *options):
+    name = repr((os.path.join(os.path.abspath(src), pattern),) + options)
+    return os.path.join(CACHE_DIR, hashlib.sha1(name.encode()).hexdigest())
+
+
+# source files with their size and modification time
+def _cache_key(files):
+    key = []
+    for f in sorted(files):
+        st = os.stat(f)
+        key.append([os.path.abspath(f), st.st_size, st.st_mtime_ns])
+    return key
+
+
+def _read_cache(path, key):
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest["key"] != key:
+        return None
+
+    # columns are memory mapped, pandas copies them into a single block
+    load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+    index = pd.DatetimeIndex(load("index.npy"), name=manifest["index"])
+    data = dict((c, load("{}.npy".format(i))) for i, c in enumerate(manifest["columns"]))
+    return pd.DataFrame(data, index=index, columns=manifest["columns"])
+
+
+def _write_cache(path, key, df):
+    # write next to the target and swap it in, readers never see half a cache
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=CACHE_DIR)
+    np.save(os.path.join(tmp, "index.npy"), df.index.values)
+    for i, c in enumerate(df.columns):
+        np.save(os.path.join(tmp, "{}.npy".format(i)), df[c].values)
+    manifest = {"key": key, "index": df.index.name, "columns": list(df.columns)}
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+
+
 ## Data Preprocessing
 class Process:
     
@@ -116,18 +222,14 @@ def equalize_length(arr, batch, where="start"):
     
 # prepare feature vectors. the hypothesis is that
 # y(t) can be determined using x1(k), x2(k), x3(k).... for all k = {t-1, t-2, t-3, ... t-N}, where 0 <= N <= t-1
-def prepare_features(dataframe, features, target, N=1):
-    x, y = [], []
+# x is a read-only view on the feature data, step keeps every step-th window only.
+def prepare_features(dataframe, features, target, N=1, step=1):
     features_data = dataframe[features].values
     target_data = dataframe[target].values
-    
-    for i in range(dataframe.shape[0]-N-1):
-        x.append(features_data[i:i+N])
-        y.append(target_data[i+N])
-    
-    x = np.array(x)
-    y = np.array(y)
-    return x, y
+
+    # note: one window less than the dashboard's version
+    count = dataframe.shape[0] - N - 1
+    return sliding_windows(features_data, target_data, N, count, step)
 
 # Inverse normalize a particular feature..
 def inverse_scale(scaler, col, scaler_idx=0):
@@ -152,21 +254,86 @@ def prepare_keras_data(df, features, target, lookback, batch_size):
     return x, y
 
 
-## Keras shapes
-class Reshape:
-    @staticmethod
-    def x(a):
-        return a.reshape((a.shape[0], 1, a.shape[1] * a.shape[2]))
-        
-    @staticmethod
-    def y(a):
-        return a.reshape((a.shape[0], 1, 1))
-    
-    @staticmethod
-    def inv_y(a):
-        return a.reshape(a.shape[0],)
+# write the feature and target columns of a (normalized) dataframe to a .npy
+# file that KerasSequence memory maps. features come first, target last.
+def save_keras_array(df, features, target, path):
+    columns = list(features) + ([target] if isinstance(target, str) else list(target))
+    dtype = np.result_type(*df[columns].dtypes)
+    arr = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(df.shape[0], len(columns)))
+    for i, c in enumerate(columns):
+        arr[:, i] = df[c].values
+    arr.flush()
+    del arr
+    return path
+
+
+# Out of core version of prepare_keras_data. batches are built from a memory
+# mapped array (see save_keras_array) when keras asks for them, so only one
+# batch of windows is in memory at a time. batch i is exactly
+# prepare_keras_data(...)[k][i * batch_size:(i + 1) * batch_size].
+#
+# shuffle   := visit the batches in a new random order every epoch. keep it off
+#              for stateful models, the windows inside a batch never move.
+# workers   := keras' fit(workers=..., use_multiprocessing=True) works as is,
+#              each process maps the file on its own. prefetch() does the
+#              same with threads outside of keras.
+class KerasSequence(Sequence):
+    def __init__(self, path, n_features, lookback, batch_size, shuffle=False, seed=None):
+        self.path = path
+        self.n_features = n_features
+        self.lookback = lookback
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self._random = np.random.RandomState(seed)
+        self._data = None
+
+        # same windows as prepare_features, minus the ones equalize_length drops
+        rows = np.load(path, mmap_mode="r").shape[0]
+        count = max(rows - lookback - 1, 0)
+        self.offset = count % batch_size
+        self.order = np.arange(count // batch_size)
+        self.on_epoch_end()
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.load(self.path, mmap_mode="r")
+        return self._data
+
+    # the memory map is not pickled, workers open the file again
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        start = self.offset + self.order[i] * self.batch_size
+        chunk = self.data[start:start + self.batch_size + self.lookback]
+        x, y = sliding_windows(chunk[:, :self.n_features], chunk[:, self.n_features:],
+                               self.lookback, self.batch_size)
+        return Reshape.x(x), Reshape.y(y)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self._random.shuffle(self.order)
+
+    # one epoch of batches, built by `workers` threads up to `ahead` batches in advance
+    def prefetch(self, workers=2, ahead=None):
+        ahead = ahead or 2 * workers
+        with ThreadPoolExecutor(workers) as pool:
+            pending = [pool.submit(self.__getitem__, i) for i in range(min(ahead, len(self)))]
+            for i in range(len(self)):
+                batch = pending[i].result()
+                pending[i] = None
+                if i + ahead < len(self):
+                    pending.append(pool.submit(self.__getitem__, i + ahead))
+                yield batch
+        self.on_epoch_end()
+
 
-    
 ## Metrics
 mean_absolute_percent_error = lambda y_true, y_pred: np.mean(np.abs((y_true - y_pred) / y_true)) * 100
 
@@ -0,0 +1,65 @@
+"""Hourly abnormality thresholds and their cache."""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dashboard"))
+
+import bucket_cache
+
+
+@pytest.fixture(scope="module")
+def dashboard():
+    for name in ("flask", "flask_login", "wtforms", "pymongo"):
+        pytest.importorskip(name)
+    import dashboard
+    return dashboard
+
+
+def logs(start, days, hours=range(24), seed=0):
+    index = pd.date_range(start, periods=days * 1440, freq="min")
+    index = index[np.isin(index.hour, list(hours))]
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({"value": rng.normal(0, 1, len(index)).cumsum()}, index=index)
+
+
+def test_threshold_cache_counts_entries_and_expires():
+    cache = bucket_cache.BucketCache(size=2, ttl=0.05)
+    for key in "abc":
+        cache.put(key, np.zeros((24, 2)), cost=1)
+    assert cache.stats()["entries"] == 2 and cache.stats()["buckets"] == 2
+    assert cache.get("a") is None and cache.evictions == 1
+    assert cache.get("c") is not None
+    time.sleep(0.1)
+    assert cache.get("c") is None and cache.expirations == 1 and cache.buckets == 1
+
+
+def test_thresholds_match_groupby(dashboard):
+    train = logs("2016-11-01", 5)
+    rate = (train.value - train.value.shift(10)).fillna(0)
+    thresholds = dashboard.hourly_thresholds(train)
+    assert thresholds.shape == (24, 2)
+    np.testing.assert_allclose(thresholds[:, 0], rate.groupby(train.index.hour).quantile(0.1).values)
+    np.testing.assert_allclose(thresholds[:, 1], rate.groupby(train.index.hour).quantile(0.9).values)
+
+
+def test_missing_hours(dashboard):
+    train = logs("2016-11-01", 5, hours=[h for h in range(24) if h not in (0, 3, 23)])
+    test = logs("2016-11-10", 1, seed=1)
+    result = dashboard.find_frequency_based_abnormalities(train, test)
+    missing = np.isin(test.index.hour, [0, 3, 23])
+    assert result.min_rate[missing].isnull().all() and result.max_rate[missing].isnull().all()
+    assert not result.abnormal[missing].any()
+
+    thresholds = dashboard.hourly_thresholds(train)
+    hours = test.index.hour[~missing]
+    np.testing.assert_allclose(result.min_rate[~missing].values, thresholds[hours, 0])
+    assert not np.isnan(thresholds[hours]).any()
+
+
+def test_empty_train(dashboard):
+    assert np.isnan(dashboard.hourly_thresholds(logs("2016-11-01", 1).iloc[:0])).all()
@@ -0,0 +1,330 @@
+"""lib/fastdtw against the implementation it replaced (fastdtw/benchmark.py)."""
+import importlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+
+import fastdtw
+from fastdtw.benchmark import _legacy_dtw, _legacy_expand_window, _legacy_fastdtw
+
+# the fastdtw.fastdtw module, the package exports its function of that name
+engine = importlib.import_module("fastdtw.fastdtw")
+
+BACKENDS = ["python"] + (["c"] if engine._cdtw is not None else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    """Runs a test on the pure Python engine and on _cdtw if it is built."""
+    if request.param == "python":
+        monkeypatch.setattr(engine, "_cdtw", None)
+    return request.param
+
+
+def difference(a, b):
+    return abs(a - b)
+
+
+def series(n, seed, dim=None):
+    rng = np.random.RandomState(seed)
+    shape = (n,) if dim is None else (n, dim)
+    return rng.normal(0, 1, shape).cumsum(axis=0)
+
+
+SIZES = [(1, 1), (1, 7), (2, 3), (10, 10), (37, 53), (120, 80), (257, 256)]
+
+
+@pytest.mark.parametrize("n, m", SIZES)
+def test_dtw_matches_legacy(backend, n, m):
+    x, y = series(n, 0), series(m, 1)
+    assert fastdtw.dtw(x, y) == _legacy_dtw(x, y, None, difference)
+
+
+@pytest.mark.parametrize("n, m", SIZES)
+@pytest.mark.parametrize("radius", [1, 3])
+def test_fastdtw_matches_legacy(backend, n, m, radius):
+    x, y = series(n, 2), series(m, 3)
+    assert fastdtw.fastdtw(x, y, radius=radius) == _legacy_fastdtw(x, y, radius, difference)
+
+
+@pytest.mark.parametrize("dist", [1, np.inf, 2])
+def test_fastdtw_matches_legacy_2d(backend, dist):
+    x, y = series(90, 4, dim=3), series(70, 5, dim=3)
+    norm = lambda a, b: np.linalg.norm(a - b, dist)
+    distance, path = fastdtw.fastdtw(x, y, radius=1, dist=dist)
+    legacy_distance, legacy_path = _legacy_fastdtw(x, y, 1, norm)
+    assert path == legacy_path
+    assert distance == pytest.approx(legacy_distance, rel=1e-12)
+
+
+def test_custom_dist_matches_legacy(backend):
+    x, y = series(60, 6), series(45, 7)
+    squared = lambda a, b: (a - b) ** 2
+    assert fastdtw.fastdtw(x, y, radius=2, dist=squared) == _legacy_fastdtw(x, y, 2, squared)
+
+
+@pytest.mark.parametrize("radius", [0, 2])
+def test_windowed_dtw_matches_legacy(backend, radius):
+    # the window of a coarse path, given to both engines
+    x, y = series(64, 8), series(50, 9)
+    _, coarse = fastdtw.dtw(x[::2], y[::2])
+    cells = _legacy_expand_window(coarse, len(x), len(y), radius)
+    lo = np.array([min(j for i, j in cells if i == r) for r in range(len(x))], dtype=np.intp)
+    hi = np.array([max(j for i, j in cells if i == r) + 1 for r in range(len(x))], dtype=np.intp)
+    result = getattr(engine, "__dtw")(x, y, (lo, hi), difference)
+    assert result == _legacy_dtw(x, y, cells, difference)
+
+
+def window_cells(lo, hi):
+    return [(i, j) for i in range(len(lo)) for j in range(lo[i], hi[i])]
+
+
+@pytest.mark.parametrize("n, m", [(8, 8), (9, 12), (64, 50), (101, 77)])
+@pytest.mark.parametrize("radius", [1, 2, 4])
+def test_expand_window_matches_legacy(backend, n, m, radius):
+    _, coarse = fastdtw.dtw(series(n // 2, 10), series(m // 2, 11))
+    lo, hi = getattr(engine, "__expand_window")(coarse, n, m, radius)
+    assert window_cells(lo, hi) == _legacy_expand_window(coarse, n, m, radius)
+
+
+@pytest.mark.parametrize("n", [2, 7, 10, 33])
+@pytest.mark.parametrize("dim", [None, 3])
+def test_reduce_by_half_matches_legacy(backend, n, dim):
+    x = series(n, 12, dim)
+    legacy = np.array([(x[i] + x[1 + i]) / 2 for i in range(0, len(x) - len(x) % 2, 2)])
+    np.testing.assert_array_equal(getattr(engine, "__reduce_by_half")(x), legacy.reshape((n // 2,) + x.shape[1:]))
+
+
+@pytest.mark.parametrize("n, m", [(2, 3), (3, 2), (10, 10), (37, 53), (120, 80), (257, 256)])
+def test_radius_0(backend, n, m):
+    # the legacy implementation raised IndexError on an odd length
+    x, y = series(n, 13), series(m, 14)
+    distance, path = fastdtw.fastdtw(x, y, radius=0)
+    assert path[0] == (0, 0) and path[-1] == (n - 1, m - 1)
+    steps = np.diff(np.array(path), axis=0)
+    assert ((steps >= 0) & (steps <= 1)).all() and (steps.sum(axis=1) > 0).all()
+    assert distance == pytest.approx(sum(abs(x[i] - y[j]) for i, j in path))
+    assert distance >= fastdtw.dtw(x, y, return_path=False)
+    assert fastdtw.fastdtw(x, y, radius=0, return_path=False) == distance
+
+
+@pytest.mark.skipif(engine._cdtw is None, reason="_cdtw is not built")
+@pytest.mark.parametrize("n, m", [(9, 12), (37, 53), (257, 256)])
+@pytest.mark.parametrize("radius", [0, 1, 3])
+def test_expand_window_backends_agree(monkeypatch, n, m, radius):
+    _, coarse = fastdtw.dtw(series(n // 2, 15), series(m // 2, 16))
+    expand = getattr(engine, "__expand_window")
+    c = expand(coarse, n, m, radius)
+    monkeypatch.setattr(engine, "_cdtw", None)
+    python = expand(coarse, n, m, radius)
+    np.testing.assert_array_equal(c[0], python[0])
+    np.testing.assert_array_equal(c[1], python[1])
+
+
+def test_backend_reports_the_engine():
+    assert fastdtw.backend == ("python" if engine._cdtw is None else "c")
+
+
+def test_falls_back_to_python_without_cdtw():
+    import subprocess
+    code = "import sys; sys.modules['fastdtw._cdtw'] = None; import fastdtw; print(fastdtw.backend)"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(engine.__file__)),
+                          stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    assert proc.stdout.strip() == "python"
+
+
+@pytest.mark.skipif(engine._cdtw is None, reason="_cdtw is not built")
+@pytest.mark.parametrize("dim, dist", [(None, None), (2, 1), (2, np.inf)])
+@pytest.mark.parametrize("return_path", [True, False])
+def test_backends_agree(monkeypatch, dim, dist, return_path):
+    x, y = series(300, 17, dim), series(211, 18, dim)
+    runs = [fastdtw.fastdtw(x, y, radius=2, dist=dist, return_path=return_path),
+            fastdtw.dtw(x, y, dist=dist, return_path=return_path)]
+    monkeypatch.setattr(engine, "_cdtw", None)
+    assert runs[0] == fastdtw.fastdtw(x, y, radius=2, dist=dist, return_path=return_path)
+    assert runs[1] == fastdtw.dtw(x, y, dist=dist, return_path=return_path)
+
+
+@pytest.mark.parametrize("n, m", SIZES)
+@pytest.mark.parametrize("radius", [0, 1, 3])
+def test_distance_only(backend, n, m, radius):
+    x, y = series(n, 19), series(m, 20)
+    assert fastdtw.dtw(x, y, return_path=False) == fastdtw.dtw(x, y)[0]
+    assert fastdtw.fastdtw(x, y, radius=radius, return_path=False) == fastdtw.fastdtw(x, y, radius=radius)[0]
+
+
+def test_distance_only_2d_and_custom_dist(backend):
+    x, y = series(80, 21, dim=2), series(95, 22, dim=2)
+    for dist in (1, 2, np.inf, lambda a, b: np.sum((a - b) ** 2)):
+        assert fastdtw.fastdtw(x, y, dist=dist, return_path=False) == fastdtw.fastdtw(x, y, dist=dist)[0]
+
+
+def profiles(count, seed):
+    rng = np.random.RandomState(seed)
+    return [series(int(rng.randint(5, 40)), seed * 100 + i) for i in range(count)]
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_pdist_matches_loop(n_jobs):
+    xs = profiles(9, 1)
+    expected = [fastdtw.fastdtw(xs[i], xs[j], radius=2)[0] for i in range(len(xs)) for j in range(i + 1, len(xs))]
+    np.testing.assert_array_equal(fastdtw.pdist(xs, radius=2, n_jobs=n_jobs), expected)
+
+    square = fastdtw.pdist(xs, radius=2, n_jobs=n_jobs, square=True)
+    assert (np.diag(square) == 0).all() and (square == square.T).all()
+    np.testing.assert_array_equal(square[np.triu_indices(len(xs), 1)], expected)
+    np.testing.assert_array_equal(fastdtw.cdist(xs, radius=2, n_jobs=n_jobs), square)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_cdist_matches_loop(n_jobs):
+    xa, xb = profiles(4, 2), profiles(6, 3)
+    expected = [[fastdtw.fastdtw(a, b, radius=1)[0] for b in xb] for a in xa]
+    np.testing.assert_array_equal(fastdtw.cdist(xa, xb, n_jobs=n_jobs), expected)
+
+
+def test_pairwise_2d_series():
+    xs = [series(n, n, dim=2) for n in (12, 20, 7)]
+    expected = [fastdtw.fastdtw(xs[i], xs[j], dist=np.inf)[0] for i in range(3) for j in range(i + 1, 3)]
+    np.testing.assert_array_equal(fastdtw.pdist(xs, dist=np.inf), expected)
+
+
+def test_pdist_edge_cases():
+    assert fastdtw.pdist([series(5, 0)]).shape == (0,)
+    assert fastdtw.pdist([series(5, 0)], square=True).shape == (1, 1)
+
+
+def brute_force(query, candidates, k, radius):
+    distances = [fastdtw.fastdtw(query, c, radius=radius, return_path=False) for c in candidates]
+    best = sorted((d, i) for i, d in enumerate(distances))[:k]
+    return [i for _, i in best], [d for d, _ in best]
+
+
+@pytest.mark.parametrize("k", [1, 3, 10])
+@pytest.mark.parametrize("radius", [1, 4])
+def test_knn_matches_brute_force(backend, k, radius):
+    candidates = [series(60, i) for i in range(40)]
+    query = candidates[7] + np.random.RandomState(0).normal(0, 0.1, 60)
+    indices, distances, stats = fastdtw.knn(query, candidates, k=k, radius=radius)
+    assert (indices, distances) == brute_force(query, candidates, k, radius)
+    assert stats["candidates"] == 40
+    assert stats["lb_kim"] + stats["lb_keogh"] + stats["dtw"] == 40
+    assert stats["dtw"] < 40
+
+
+def test_knn_unequal_lengths_and_reused_envelopes():
+    candidates = profiles(25, 4)
+    envelopes = fastdtw.lb_envelopes(candidates)
+    for seed in range(3):
+        query = series(30, 50 + seed)
+        result = fastdtw.knn(query, candidates, k=2, envelopes=envelopes)
+        assert result[:2] == brute_force(query, candidates, 2, 1)
+
+
+def test_knn_window_of_full_length_is_exact():
+    candidates = [series(50, i) for i in range(15)]
+    query = series(50, 99)
+    assert fastdtw.knn(query, candidates, k=3, window=50)[:2] == brute_force(query, candidates, 3, 1)
+
+
+def test_knn_k_larger_than_candidates():
+    candidates = [series(20, i) for i in range(4)]
+    indices, distances, stats = fastdtw.knn(series(20, 9), candidates, k=10)
+    assert (indices, distances) == brute_force(series(20, 9), candidates, 10, 1)
+    assert len(indices) == 4 and stats["dtw"] == 4
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_knn_rejects_k_below_1(k):
+    with pytest.raises(ValueError):
+        fastdtw.knn(series(20, 0), [series(20, 1)], k=k)
+
+
+def spring(stream, reference, threshold):
+    ''' offline SPRING over the whole stream with the full cost matrix '''
+    n, m = len(stream), len(reference)
+    cost = np.abs(np.subtract.outer(reference, stream))
+    D = np.full((m + 1, n + 1), np.inf)
+    S = np.zeros((m + 1, n + 1), dtype=int)
+    D[0] = 0
+    S[0, 1:] = np.arange(n)
+    matches, dmin, ts, te = [], np.inf, None, None
+    for t in range(1, n + 1):
+        for i in range(1, m + 1):
+            # left, up, diagonal; ties keep the first
+            options = [(D[i - 1, t], S[i - 1, t]), (D[i, t - 1], S[i, t - 1]),
+                       (D[i - 1, t - 1], S[i - 1, t - 1])]
+            best, start = min(options, key=lambda o: o[0])
+            D[i, t], S[i, t] = cost[i - 1, t - 1] + best, start
+        if dmin <= threshold and np.all((D[1:, t] >= dmin) | (S[1:, t] > te)):
+            matches.append((ts, te, dmin))
+            dmin = np.inf
+            D[1:, t][S[1:, t] <= te] = np.inf
+        if D[m, t] <= threshold and D[m, t] < dmin:
+            dmin, ts, te = D[m, t], S[m, t], t - 1
+    return matches, [(ts, te, dmin)] if dmin <= threshold else []
+
+
+def noisy_stream(seed, reference, n=300, copies=4):
+    rs = np.random.RandomState(seed)
+    stream = rs.normal(0, 3, n).cumsum() / 4
+    for at in rs.choice(n // len(reference), copies, replace=False) * len(reference):
+        stretched = np.interp(np.linspace(0, len(reference) - 1, rs.randint(len(reference) - 3, len(reference) + 4)),
+                              np.arange(len(reference)), reference)
+        stream[at:at + len(stretched)] = stretched[:n - at] + rs.normal(0, 0.2, len(stretched[:n - at]))
+    return stream
+
+
+REFERENCE = np.sin(np.linspace(0, 2 * np.pi, 16)) * 5
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("threshold", [6.0, 10.0, 20.0])
+def test_streaming_matches_offline_spring(seed, threshold):
+    # ends on the reference so a match is still pending at the end
+    stream = np.concatenate([noisy_stream(seed, REFERENCE), REFERENCE])
+    matcher = fastdtw.StreamingSubsequenceDTW(REFERENCE, threshold)
+    matches = [matcher.update(x) for x in stream]
+    expected, pending = spring(stream, REFERENCE, threshold)
+    assert sum(matches, []) == pytest.approx(expected)
+    assert matcher.flush() == pytest.approx(pending)
+    assert matcher.flush() == []
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 16, 300])
+def test_streaming_chunks_match_a_single_update(chunk):
+    stream = noisy_stream(1, REFERENCE)
+    whole = fastdtw.StreamingSubsequenceDTW(REFERENCE, 10.0)
+    chunked = fastdtw.StreamingSubsequenceDTW(REFERENCE, 10.0)
+    matches = []
+    for i in range(0, len(stream), chunk):
+        matches += chunked.update(stream[i:i + chunk])
+    assert matches == whole.update(stream)
+    assert chunked.flush() == whole.flush()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_streaming_matches_are_valid(seed):
+    stream = noisy_stream(seed, REFERENCE)
+    matcher = fastdtw.StreamingSubsequenceDTW(REFERENCE, 10.0)
+    matches = matcher.update(stream) + matcher.flush()
+    assert matches
+    previous_end = -1
+    for start, end, distance in matches:
+        assert previous_end < start <= end < len(stream)
+        assert distance <= 10.0
+        assert distance == pytest.approx(fastdtw.dtw(stream[start:end + 1], REFERENCE)[0])
+        previous_end = end
+
+
+def test_streaming_flush_reports_the_pending_match_once():
+    matcher = fastdtw.StreamingSubsequenceDTW([1, 2, 3], threshold=1)
+    assert matcher.update([5, 5, 1, 2, 3]) == []
+    assert matcher.flush() == [(2, 4, 0.0)]
+    assert matcher.flush() == []
+    # the points of a flushed match cannot be reused by the next one
+    assert matcher.update([5, 1, 2, 3, 5]) == [(6, 8, 0.0)]
@@ -0,0 +1,149 @@
+"""Forecast worker ranges, stored forecast coverage and on-demand forecasts."""
+import datetime as dt
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dashboard"))
+
+import forecaster
+
+
+CONFIG = {"target": "cwshdr", "features": ["loadsys", "drybulb"], "lookback": 15, "model_name": "last.npz"}
+
+
+class LastValue:
+    """Predicts the last feature of the last row of each window."""
+
+    def predict(self, X, batch_size=None):
+        return X[:, 0, -1]
+
+
+class Models:
+    def configs(self):
+        return [CONFIG]
+
+    def get(self, name):
+        return LastValue()
+
+
+def utc(*args):
+    return dt.datetime(*args, tzinfo=pytz.UTC)
+
+
+def minute_logs(start, minutes, seed=0):
+    rng = np.random.RandomState(seed)
+    index = pd.date_range(start, periods=minutes, freq="min")
+    columns = CONFIG["features"] + [CONFIG["target"]]
+    return pd.DataFrame(rng.uniform(20, 30, (minutes, len(columns))), index=index, columns=columns)
+
+
+def fetch_from(logs):
+    def fetch(site, fields, start, end):
+        start, end = start.replace(tzinfo=None), end.replace(tzinfo=None)
+        return logs.loc[(logs.index > start) & (logs.index <= end), fields].copy()
+    return fetch
+
+
+def test_run_once_forecasts_whole_days_from_start_to_end():
+    worker = forecaster.ForecastWorker(None, Models(), None, sites=["np"])
+    ranges = []
+    worker.forecast = lambda site, config, start, end: ranges.append((start, end)) or 0
+
+    worker.run_once(now=utc(2017, 1, 10, 12), start=utc(2017, 1, 1, 6), end=utc(2017, 1, 3, 8))
+    assert ranges == [(utc(2017, 1, 1), utc(2017, 1, 2)), (utc(2017, 1, 2), utc(2017, 1, 3)),
+                      (utc(2017, 1, 3), utc(2017, 1, 3, 8))]
+
+    # never past now
+    ranges.clear()
+    worker.run_once(now=utc(2017, 1, 1, 12), start=utc(2017, 1, 1), end=utc(2017, 2, 1))
+    assert ranges == [(utc(2017, 1, 1), utc(2017, 1, 1, 12))]
+
+
+def test_forecast_logs():
+    logs = minute_logs("2017-01-01", 120)
+    fetch = fetch_from(logs)
+    assert forecaster.forecast_logs(LastValue(), fetch, "np", CONFIG, utc(2017, 1, 1), utc(2017, 1, 1), 64) is None
+
+    index, values, predicted = forecaster.forecast_logs(
+        LastValue(), fetch, "np", CONFIG, utc(2017, 1, 1, 0, 30), utc(2017, 1, 1, 1, 30), 64)
+    expected = forecaster.predict(LastValue(), logs.iloc[16:91].copy(), CONFIG["features"], CONFIG["target"], 15, 64)
+    assert index[0] == pd.Timestamp("2017-01-01 00:31") and len(index) == 60
+    assert np.isfinite(predicted).all()
+    np.testing.assert_allclose(values, expected[1])
+    np.testing.assert_allclose(predicted, expected[2])
+
+
+
+def test_forecast_logs_looks_back_over_unlogged_minutes():
+    logs = minute_logs("2017-01-01", 120)
+    logs = logs.drop(logs.index[20:30])
+    index, _, _ = forecaster.forecast_logs(
+        LastValue(), fetch_from(logs), "np", CONFIG, utc(2017, 1, 1, 0, 35), utc(2017, 1, 1, 1), 64)
+    assert index[0] == pd.Timestamp("2017-01-01 00:36") and len(index) == 25
+
+@pytest.fixture
+def db():
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient(tz_aware=True).dashboard
+    db.log.insert_many([{"_site": "np", "timestamp": utc(2017, 1, 1) + dt.timedelta(minutes=m)}
+                        for m in range(0, 600, 2)])
+    return db
+
+
+def store(db, start, end):
+    minute = start
+    while minute <= end:
+        db[forecaster.COLLECTION].insert_one({"_site": "np", "target": "cwshdr", "timestamp": minute})
+        minute += dt.timedelta(minutes=1)
+
+
+def test_covers(db):
+    start, end = utc(2017, 1, 1), utc(2017, 1, 1, 10)
+    assert not forecaster.covers(db, "np", "cwshdr", start, end, 15)
+
+    # the first `lookback` minutes of the logs are never forecast
+    store(db, utc(2017, 1, 1, 0, 16), utc(2017, 1, 1, 9, 58))
+    assert forecaster.covers(db, "np", "cwshdr", start, end, 15)
+    assert not forecaster.covers(db, "np", "cwshdr", start, end, 10)
+
+    # only the logged minutes matter, none after 9:58
+    assert forecaster.covers(db, "np", "cwshdr", utc(2017, 1, 1, 2), utc(2017, 1, 2), 15)
+    assert forecaster.covers(db, "np", "cwshdr", utc(2017, 1, 2), utc(2017, 1, 3), 15)
+    assert not forecaster.covers(db, "np", "other", start, end, 15)
+
+
+def test_covers_without_logs(db):
+    assert forecaster.covers(db, "insead", "cwshdr", utc(2017, 1, 1), utc(2017, 1, 2), 15)
+
+
+@pytest.fixture
+def dashboard(monkeypatch):
+    for name in ("flask", "flask_login", "wtforms"):
+        pytest.importorskip(name)
+    import dashboard
+    monkeypatch.setitem(dashboard.app.config, "models", Models())
+    return dashboard
+
+
+@pytest.mark.parametrize("freq", ["minutes", "hours", "days"])
+def test_forecast_window_aggregates_the_window(dashboard, monkeypatch, freq):
+    logs = minute_logs("2017-01-01", 3 * 1440)
+    monkeypatch.setattr(dashboard, "fetch_logs", fetch_from(logs))
+
+    start, end = utc(2017, 1, 1, 12), utc(2017, 1, 2, 12)
+    results = dashboard.forecast_window("np", CONFIG, start, end, freq)
+
+    index, values, predicted = forecaster.forecast_logs(
+        LastValue(), fetch_from(logs), "np", CONFIG, start, end, 64)
+    df = pd.DataFrame({"value": values, "predicted": predicted}, index=index)
+    df = df[df.index >= pd.Timestamp("2017-01-01 12:00")]
+    expected = df.resample({"minutes": "min", "hours": "h", "days": "D"}[freq]).mean()
+    assert [r["_id"] for r in results] == [t.strftime("%Y-%m-%dT%H:%M:%S.%f") for t in expected.index]
+    np.testing.assert_allclose([r["predicted"] for r in results], expected.predicted.values)
+    np.testing.assert_allclose([r["value"] for r in results], expected.value.values)
+    assert np.isfinite(expected.values).all()
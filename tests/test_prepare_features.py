@@ -0,0 +1,88 @@
+"""prepare_features of the notebooks and the dashboard against their old loops."""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "dashboard"))
+sys.path.insert(0, os.path.join(ROOT, "notebooks"))
+
+import common
+import process
+
+
+def notebook_loop(dataframe, features, target, N=1):
+    """notebooks/common.prepare_features before sliding_windows."""
+    x, y = [], []
+    features_data = dataframe[features].values
+    target_data = dataframe[target].values
+    for i in range(dataframe.shape[0] - N - 1):
+        x.append(features_data[i:i + N])
+        y.append(target_data[i + N])
+    return np.array(x), np.array(y)
+
+
+def dashboard_loop(dataframe, features, target, N=1):
+    """dashboard/process.prepare_features before sliding_windows."""
+    x, y = [], []
+    features_data = dataframe[features].values
+    target_data = dataframe[target].values
+    for i in range(dataframe.shape[0] - N):
+        x.append(features_data[i:i + N])
+        y.append(target_data[i + N])
+    return np.array(x), np.array(y)
+
+
+def frame(rows):
+    rng = np.random.RandomState(rows)
+    return pd.DataFrame(rng.uniform(size=(rows, 3)), columns=["a", "b", "c"])
+
+
+CASES = [
+    (common.prepare_features, notebook_loop),
+    (process.prepare_features, dashboard_loop),
+]
+
+
+@pytest.mark.parametrize("new, old", CASES)
+@pytest.mark.parametrize("rows", [0, 1, 5, 6, 7, 100])
+@pytest.mark.parametrize("N", [1, 5])
+@pytest.mark.parametrize("features, target", [(["a", "b"], ["c"]), (["a", "b"], "c"), ("a", ["c"])])
+def test_matches_loop(new, old, rows, N, features, target):
+    df = frame(rows)
+    x, y = new(df, features, target, N)
+    x_old, y_old = old(df, features, target, N)
+    assert x.shape == x_old.shape and y.shape == y_old.shape
+    np.testing.assert_array_equal(x, x_old)
+    np.testing.assert_array_equal(y, y_old)
+
+
+@pytest.mark.parametrize("new, old", CASES)
+@pytest.mark.parametrize("step", [2, 3, 7])
+def test_step_keeps_every_step_th_window(new, old, step):
+    df = frame(50)
+    x, y = new(df, ["a", "b"], ["c"], 5, step=step)
+    x_old, y_old = old(df, ["a", "b"], ["c"], 5)
+    np.testing.assert_array_equal(x, x_old[::step])
+    np.testing.assert_array_equal(y, y_old[::step])
+
+
+@pytest.mark.parametrize("new", [common.prepare_features, process.prepare_features])
+def test_windows_are_read_only_views(new):
+    df = frame(20)
+    x, _ = new(df, ["a", "b"], ["c"], 5)
+    assert not x.flags.writeable
+    assert x.base is not None
+
+
+@pytest.mark.parametrize("new", [common.prepare_features, process.prepare_features])
+@pytest.mark.parametrize("target", [["c"], "c"])
+def test_targets_are_copies(new, target):
+    df = frame(20)
+    before = df.copy()
+    _, y = new(df, ["a", "b"], target, 5)
+    y[:] = -1
+    pd.testing.assert_frame_equal(df, before)
@@ -0,0 +1,37 @@
+"""Importing the dashboard leaves the slow packages to the endpoints using them."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+DASHBOARD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dashboard")
+
+HEAVY = ["tensorflow", "keras", "pandas", "sklearn"]
+
+
+def imported(module):
+    """HEAVY packages imported by `import module` in a fresh interpreter."""
+    code = "import sys, {}; print(' '.join(m for m in {!r} if m in sys.modules))".format(module, HEAVY)
+    proc = subprocess.run([sys.executable, "-c", code], cwd=DASHBOARD,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout.split()
+
+
+def test_dashboard_import():
+    for name in ("flask", "flask_login", "wtforms", "pymongo"):
+        pytest.importorskip(name)
+    assert imported("dashboard") == []
+
+
+def test_forecaster_import():
+    assert imported("forecaster") == []
+
+
+def test_import_report_forbid():
+    run = lambda *forbid: subprocess.run(
+        [sys.executable, "import_report.py", "--module", "forecaster", "--forbid"] + list(forbid),
+        cwd=DASHBOARD, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert run(*HEAVY).returncode == 0
+    assert run("numpy").returncode == 1